@@ -27,12 +27,12 @@ class CallController(QObject):
     call_ended = pyqtSignal(str)  # call_id
     call_failed = pyqtSignal(str, str)  # call_id, error_message
     
-    def __init__(self, current_user: str, use_firebase_signaling: bool = True):
+    def __init__(self, current_user: str, use_firebase_signaling: bool = True, settings_manager: Optional[SettingsManager] = None):
         super().__init__()
         self.current_user = current_user
         self.use_firebase_signaling = use_firebase_signaling
-        # Load settings for Agora
-        self.settings_manager = SettingsManager()
+        # Load settings for Agora; a shared manager already holds them in its cache
+        self.settings_manager = settings_manager or SettingsManager()
         self.settings = self.settings_manager.load_settings()
         # Ensure an App ID is always present (App ID only mode)
         self.agora_app_id = self.settings.get('agora_app_id') or 'd47e822a706d4a2db70fe31ce36e5a0f'
@@ -82,7 +82,8 @@ class CallController(QObject):
         # Setup connections
         self.setup_connections()
         
-        # Initialize WebRTC service
+        # Initialize WebRTC service; ready_event is set once initialization has finished, successfully or not
+        self.ready_event = asyncio.Event()
         self.initialization_task = asyncio.create_task(self.initialize_webrtc())
     
     def setup_connections(self):
@@ -131,6 +132,8 @@ class CallController(QObject):
                 self.firebase_signaling.answer_received.connect(self.on_firebase_answer_received)
             if hasattr(self.firebase_signaling, 'ice_candidate_received'):
                 self.firebase_signaling.ice_candidate_received.connect(self.on_firebase_ice_candidate_received)
+            if hasattr(self.firebase_signaling, 'ice_candidates_batch'):
+                self.firebase_signaling.ice_candidates_batch.connect(self.on_firebase_ice_candidates_received)
             if hasattr(self.firebase_signaling, 'quantum_key_requested'):
                 self.firebase_signaling.quantum_key_requested.connect(self.on_firebase_quantum_key_requested)
     
@@ -180,6 +183,8 @@ class CallController(QObject):
         except Exception as e:
             log.error(f"Error initializing call controller: {e}")
             self.call_failed.emit("", f"Error initializing call service: {e}")
+        finally:
+            self.ready_event.set()
     
     def get_webrtc_widget(self):
         """Get the WebRTC widget"""
@@ -693,6 +698,13 @@ class CallController(QObject):
         # Forward to WebRTC widget
         self.webrtc_widget.handle_ice_candidate(call_id, candidate)
     
+    @pyqtSlot(str, list)
+    def on_firebase_ice_candidates_received(self, call_id: str, candidates: list):
+        """Handle a burst of ICE candidates received via Firebase"""
+        log.debug(f"Firebase: {len(candidates)} ICE candidates received for call {call_id}")
+        # Forward to WebRTC widget
+        self.webrtc_widget.handle_ice_candidates(call_id, candidates)
+    
     @pyqtSlot(str, str)
     def on_firebase_quantum_key_requested(self, call_id: str, quantum_key_id: str):
         """Handle quantum key request via Firebase"""
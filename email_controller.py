@@ -3,6 +3,7 @@
 import asyncio
 import logging
 import json
+import collections
 from email.header import decode_header, make_header
 from email.utils import getaddresses
 
@@ -16,7 +17,25 @@ import html_templates
 log = logging.getLogger(__name__)
 
 PAGE_SIZE = 50
+FULL_EMAIL_CACHE_SIZE = 32
 NETWORK_TIMEOUT = 15  # seconds
+ATTACHMENT_TIMEOUT = 120  # seconds; attachments can be large, but a dead server must not hang the download
+
+def _encrypted_payload_size(body, attachments):
+    # Byte length of the JSON payload CryptoService.encrypt builds, computed without
+    # base64-encoding every attachment a second time: base64 text is JSON-safe ASCII
+    # of exactly 4 * ceil(n / 3) characters.
+    skeleton = json.dumps({
+        'body': body,
+        'attachments': [{'filename': att['filename'], 'content_b64': ''} for att in attachments]
+    })
+    return len(skeleton.encode('utf-8')) + sum(4 * ((len(att['content']) + 2) // 3) for att in attachments)
+
+def _retrieve_warmup_error(task):
+    # The warm-up may fail after the send has already given up on it; read the
+    # exception so asyncio does not report it as never retrieved.
+    if not task.cancelled() and task.exception() is not None:
+        log.debug(f"SMTP warm-up failed: {task.exception()}")
 
 class EmailController:
     def __init__(self, main_window):
@@ -28,11 +47,15 @@ class EmailController:
         self.current_folder_load_task, self.current_email_load_task = None, None
         self.current_email_object = None
         self.call_controller = None
+        # Next page of headers, fetched in the background while the user reads the current one.
+        self._prefetch_task, self._prefetch_cache = None, {}
+        # LRU of parsed fetch_full_email results for the current folder, keyed by UID.
+        self._full_email_cache = collections.OrderedDict()
 
     async def apply_settings_and_connect(self):
         self.main_window.set_busy_state()
         try:
-            self.settings = self.settings_manager.load_settings()
+            self.settings = await self.settings_manager.aload_settings()
             
             if not self.settings.get('email_address') or not self.settings.get('password'):
                 log.warning("Application is not configured. Aborting connection attempt.")
@@ -82,9 +105,11 @@ class EmailController:
         await self.apply_settings_and_connect()
 
     async def shutdown(self):
+        self._reset_prefetch()
         if self.current_folder_load_task and not self.current_folder_load_task.done(): self.current_folder_load_task.cancel()
         if self.current_email_load_task and not self.current_email_load_task.done(): self.current_email_load_task.cancel()
         if self.imap_handler: await self.imap_handler.disconnect()
+        if self.smtp_handler: await self.smtp_handler.disconnect()
         if self.crypto_service: await self.crypto_service.close()
 
     def _initialize_handlers(self):
@@ -106,6 +131,8 @@ class EmailController:
             self.main_window.set_busy_state()
             self.main_window.update_conversation_actions(enabled=False)
             self.current_email_object = None
+            self._reset_prefetch()
+            self._full_email_cache.clear()
             self.current_folder_original_name = original_folder_name
             all_uids = await asyncio.wait_for(self.imap_handler.get_all_uids_in_folder(original_folder_name), timeout=NETWORK_TIMEOUT)
             self.current_folder_uids = list(reversed(all_uids))
@@ -125,11 +152,19 @@ class EmailController:
     async def load_next_page_of_emails(self):
         if self.loaded_uids_count >= len(self.current_folder_uids): return
         self.main_window.set_busy_state()
+        folder = self.current_folder_original_name
         start, end = self.loaded_uids_count, self.loaded_uids_count + PAGE_SIZE
         try:
-            headers = await asyncio.wait_for(self.imap_handler.fetch_email_headers(self.current_folder_original_name, self.current_folder_uids[start:end]), timeout=NETWORK_TIMEOUT)
+            key = (folder, start, end)
+            if key not in self._prefetch_cache and self._prefetch_task and not self._prefetch_task.done():
+                await self._prefetch_task
+            headers = self._prefetch_cache.pop(key, None)
+            if headers is None:
+                headers = await asyncio.wait_for(self.imap_handler.fetch_email_headers(folder, self.current_folder_uids[start:end]), timeout=NETWORK_TIMEOUT)
             self.main_window.append_emails_to_list(headers)
             self.loaded_uids_count += len(headers)
+            if self.loaded_uids_count < len(self.current_folder_uids):
+                self._prefetch_task = asyncio.create_task(self._prefetch(folder, self.loaded_uids_count, self.loaded_uids_count + PAGE_SIZE))
         except asyncio.TimeoutError:
             self.main_window.show_error_message("Fetch Timed Out", f"Could not fetch more emails within {NETWORK_TIMEOUT} seconds.")
         except EmailServiceError as e:
@@ -137,6 +172,22 @@ class EmailController:
         finally:
              self.main_window.set_idle_state()
 
+    async def _prefetch(self, folder, start, end):
+        try:
+            headers = await asyncio.wait_for(self.imap_handler.fetch_email_headers(folder, self.current_folder_uids[start:end]), timeout=NETWORK_TIMEOUT)
+        except (asyncio.TimeoutError, EmailServiceError) as e:
+            # Best effort only; the page is fetched on demand when the user scrolls.
+            log.warning(f"Prefetch of emails {start}-{end} in {folder} failed: {e}")
+            return
+        if folder == self.current_folder_original_name:
+            self._prefetch_cache[(folder, start, end)] = headers
+
+    def _reset_prefetch(self):
+        if self._prefetch_task and not self._prefetch_task.done():
+            self._prefetch_task.cancel()
+        self._prefetch_task = None
+        self._prefetch_cache.clear()
+
 
     def handle_refresh_emails(self):
         if self.current_folder_original_name:
@@ -154,7 +205,9 @@ class EmailController:
             self.current_email_object = None
             self.main_window.display_email_content({})
             
-            self.current_email_object = await asyncio.wait_for(self.imap_handler.fetch_full_email(uid), timeout=NETWORK_TIMEOUT)
+            self.current_email_object = await self._get_full_email(uid)
+            # Cancellation checkpoint: a newer selection may already have replaced this one.
+            await asyncio.sleep(0)
             
             json_payload_str = self.current_email_object.get('plain_body')
             is_qumail, qumail_data = False, None
@@ -191,6 +244,7 @@ class EmailController:
                 elif security_level == 4 and "plaintext_payload" in qumail_data:
                      decrypted_payload = qumail_data.get("plaintext_payload")
                 
+                await asyncio.sleep(0)
                 if decrypted_payload:
                     self.main_window.display_email_content({
                         'html_body': decrypted_payload.get('body'), 
@@ -199,6 +253,7 @@ class EmailController:
                 else:
                     raise DecryptionError("Decryption process yielded no content.")
             else:
+                await asyncio.sleep(0)
                 self.main_window.display_email_content(self.current_email_object)
             
             self.main_window.update_conversation_actions(enabled=True)
@@ -209,15 +264,35 @@ class EmailController:
             log.info("Email load task was successfully cancelled.")
             raise
         except (KeyGenerationError, DecryptionError, EmailServiceError) as e:
-            failed_html = html_templates.DECRYPTION_FAILED_TEMPLATE.format(error_message=e)
+            failed_html = html_templates.render_decryption_failed(e)
             self.main_window.display_email_content({'html_body': failed_html})
         except Exception as e:
             log.error(f"Unexpected error displaying email: {e}", exc_info=True)
-            failed_html = html_templates.DECRYPTION_FAILED_TEMPLATE.format(error_message=f"An unexpected error occurred: {e}")
+            failed_html = html_templates.render_decryption_failed(f"An unexpected error occurred: {e}")
             self.main_window.display_email_content({'html_body': failed_html})
         finally:
             self.main_window.set_idle_state()
 
+    async def _get_full_email(self, uid):
+        cached = self._full_email_cache.get(uid)
+        if cached is not None:
+            self._full_email_cache.move_to_end(uid)
+            return cached
+        email_object = await asyncio.wait_for(self.imap_handler.fetch_full_email(uid), timeout=NETWORK_TIMEOUT)
+        self._full_email_cache[uid] = email_object
+        if len(self._full_email_cache) > FULL_EMAIL_CACHE_SIZE:
+            self._full_email_cache.popitem(last=False)
+        return email_object
+
+    async def fetch_attachment(self, att):
+        # Resolved at call time so a deferred attachment survives a reconnect after a settings change
+        if not self.imap_handler:
+            raise EmailServiceError("Not connected to the mail server.")
+        try:
+            return await asyncio.wait_for(self.imap_handler.fetch_part(*att['location']), timeout=ATTACHMENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise EmailServiceError(f"Timed out downloading {att['filename']}.") from None
+
     def _format_quoted_body(self):
         if not self.current_email_object: return ""
         msg = self.current_email_object['raw_message']
@@ -268,6 +343,8 @@ class EmailController:
         if not self.smtp_handler: return False
         from_addr = self.settings['email_address']
         final_body = body
+        # Warm up the SMTP session while keys are fetched and the payload is encrypted.
+        smtp_warmup = asyncio.create_task(self.smtp_handler.ensure_connected())
         try:
             if security_level == 3:
                 recipient_public_key_b64 = await self.crypto_service.get_public_key(to_addr.split(',')[0].strip())
@@ -286,11 +363,7 @@ class EmailController:
                 else:
                     # Use PQC for backward compatibility
                     # For Level 1 OTP, we need a key as long as the payload
-                    payload_size = len(json.dumps({
-                        'body': body,
-                        'attachments': [{'filename': att['filename'], 'content_b64': base64.b64encode(att['content']).decode('utf-8')} for att in attachments]
-                    }).encode('utf-8'))
-                    key_length = payload_size if security_level == 1 else 32
+                    key_length = _encrypted_payload_size(body, attachments) if security_level == 1 else 32
                     key_id, key_hex = await self.crypto_service.get_symmetric_key(key_length)
                     final_body = await self.crypto_service.encrypt(
                         body.encode('utf-8'), attachments, 
@@ -300,6 +373,7 @@ class EmailController:
                         key_hex=key_hex
                     )
             
+            await smtp_warmup
             await self.smtp_handler.send_email(to_addr, subject, final_body, from_addr, attachments if security_level == 4 else [])
             return True
             
@@ -311,4 +385,8 @@ class EmailController:
             log.error(f"An unexpected error occurred during send: {e}", exc_info=True)
             self.main_window.show_error_message("Send Failed", f"An unexpected error occurred: {e}")
             return False
+        finally:
+            # Cancelling would not stop the login running in the executor; let it finish so
+            # the session it opens is kept for the next send.
+            smtp_warmup.add_done_callback(_retrieve_warmup_error)
 
@@ -5,14 +5,19 @@ import smtplib
 import logging
 import re
 import base64
+import binascii
 import json
 import socket
+import random
+import functools
+import quopri
+import urllib.parse
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.application import MIMEApplication
 from email.parser import BytesParser
 from email.header import decode_header, make_header
-from email.utils import getaddresses
+from email.utils import getaddresses, decode_rfc2231, collapse_rfc2231_value
 from bs4 import BeautifulSoup
 
 log = logging.getLogger(__name__)
@@ -20,12 +25,211 @@ log = logging.getLogger(__name__)
 class EmailServiceError(Exception):
     pass
 
+# Transient network failures worth retrying; anything else (bad credentials,
+# protocol errors, DNS failures) is surfaced to the user straight away.
+RECOVERABLE_ERRORS = (imaplib.IMAP4.abort, socket.timeout, smtplib.SMTPServerDisconnected, ConnectionError)
+
+def _is_recoverable(exc):
+    # Handlers wrap low-level errors in EmailServiceError, so walk the cause chain.
+    while exc is not None:
+        if isinstance(exc, imaplib.IMAP4.error) and 'AUTHENTICATIONFAILED' in str(exc).upper():
+            return False
+        if isinstance(exc, RECOVERABLE_ERRORS):
+            return True
+        exc = exc.__cause__
+    return False
+
+def retry(retries=3, base=1.0, cap=30.0, jitter=0.5):
+    """Retries a handler coroutine on recoverable errors with capped exponential backoff.
+
+    The handler's connection is reset between attempts so the next call reconnects.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            attempt = 0
+            while True:
+                try:
+                    return await func(self, *args, **kwargs)
+                except Exception as e:
+                    if attempt >= retries or not _is_recoverable(e):
+                        raise
+                    delay = min(cap, base * (2 ** attempt) * (1 + random.uniform(-jitter, jitter)))
+                    attempt += 1
+                    log.warning(f"{func.__qualname__} failed ({e!r}); retry {attempt}/{retries} in {delay:.1f}s")
+                    await self._reset_connection()
+                    await asyncio.sleep(delay)
+        return wrapper
+    return decorator
+
+def _serialized(func):
+    # An imaplib connection is not safe for concurrent use from executor threads;
+    # keep a single command in flight so background prefetches can't interleave.
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        async with self._lock:
+            return await func(self, *args, **kwargs)
+    return wrapper
+
+# --- Minimal parser for IMAP FETCH responses (BODYSTRUCTURE and BODY[...] sections) ---
+_IMAP_ATOM = re.compile(rb'[^ ()"{]+')
+
+def _join_fetch_response(data):
+    # imaplib splits literals out into (prefix, literal) tuples; stitch them back into one stream.
+    chunks = []
+    for item in data:
+        if isinstance(item, tuple):
+            chunks.append(item[0] + b'\r\n' + item[1])
+        elif item:
+            chunks.append(item)
+    return b''.join(chunks)
+
+def _parse_imap_list(data, pos):
+    """Parses the parenthesised list at data[pos]. Returns (items, end_pos).
+
+    Strings, literals and atoms are returned as bytes, NIL as None.
+    """
+    items, pos = [], pos + 1
+    while True:
+        c = data[pos:pos + 1]
+        if c == b'':
+            raise ValueError("Unterminated list in IMAP response")
+        elif c in (b' ', b'\r', b'\n'):
+            pos += 1
+        elif c == b')':
+            return items, pos + 1
+        elif c == b'(':
+            item, pos = _parse_imap_list(data, pos)
+            items.append(item)
+        elif c == b'"':
+            buf, pos = bytearray(), pos + 1
+            while (c := data[pos:pos + 1]) != b'"':
+                if c == b'':
+                    raise ValueError("Unterminated string in IMAP response")
+                if c == b'\\':
+                    pos += 1
+                buf += data[pos:pos + 1]
+                pos += 1
+            items.append(bytes(buf))
+            pos += 1
+        elif c == b'{':
+            end = data.index(b'}', pos)
+            size, start = int(data[pos + 1:end]), data.index(b'\n', end) + 1
+            items.append(data[start:start + size])
+            pos = start + size
+        else:
+            match = _IMAP_ATOM.match(data, pos)
+            atom, pos = match.group(), match.end()
+            items.append(None if atom.upper() == b'NIL' else atom)
+
+def _fetch_items(data):
+    """Returns the FETCH data items (e.g. 'BODYSTRUCTURE', 'BODY[1]') of a UID FETCH response."""
+    stream, items, pos = _join_fetch_response(data), {}, 0
+    while (pos := stream.find(b'(', pos)) != -1:
+        values, pos = _parse_imap_list(stream, pos)
+        for name, value in zip(values[::2], values[1::2]):
+            if isinstance(name, bytes):
+                items[name.decode('ascii', 'ignore').upper()] = value
+    return items
+
+def _text(value):
+    return value.decode('utf-8', 'ignore') if isinstance(value, bytes) else value
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    return {_text(k).lower(): _text(v) for k, v in zip(value[::2], value[1::2])}
+
+def _walk_bodystructure(node, path=()):
+    """Yields one dict per leaf part of a parsed BODYSTRUCTURE, with its IMAP section number."""
+    if isinstance(node[0], list):
+        # Multipart: the child parts come first, followed by the subtype and extension data.
+        for index, child in enumerate(node, 1):
+            if not isinstance(child, list):
+                break
+            yield from _walk_bodystructure(child, path + (index,))
+        return
+    maintype, subtype = _text(node[0]).lower(), _text(node[1]).lower()
+    params = _params(node[2])
+    # Extension data starts after the type-specific fields (lines for text, envelope/body/lines for message/rfc822).
+    ext = 8 if maintype == 'text' else 10 if (maintype, subtype) == ('message', 'rfc822') else 7
+    disposition = node[ext + 1] if len(node) > ext + 1 and isinstance(node[ext + 1], list) else None
+    disp_params = _params(disposition[1]) if disposition and len(disposition) > 1 else {}
+    filename = disp_params.get('filename') or params.get('name')
+    if not filename and (encoded := disp_params.get('filename*') or params.get('name*')):
+        # Same steps as email.message's get_param: split, percent-decode as latin-1, then apply the charset
+        charset, language, value = decode_rfc2231(encoded)
+        filename = collapse_rfc2231_value((charset, language, urllib.parse.unquote(value, encoding='latin-1')))
+    yield {
+        'section': '.'.join(map(str, path)) or '1',
+        'content_type': f"{maintype}/{subtype}",
+        'charset': params.get('charset'),
+        'content_id': _text(node[3]),
+        'encoding': (_text(node[5]) or '7bit').lower(),
+        'size': int(node[6] or 0),
+        'disposition': _text(disposition[0]).lower() if disposition else '',
+        'filename': filename,
+    }
+
+def _decode_transfer(payload, encoding):
+    if encoding == 'base64':
+        try:
+            return binascii.a2b_base64(payload)
+        except binascii.Error:
+            # Be as forgiving as get_payload(decode=True): drop a dangling character and fix the padding.
+            data = re.sub(rb'[^A-Za-z0-9+/]', b'', payload)
+            data = data[:len(data) // 4 * 4] if len(data) % 4 == 1 else data
+            return binascii.a2b_base64(data + b'=' * (-len(data) % 4))
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(payload)
+    return payload
+
+def _decode_text(payload, charset):
+    try:
+        return payload.decode(charset or 'utf-8', 'ignore')
+    except LookupError:
+        return payload.decode('utf-8', 'ignore')
+
+def _rewrite_html(html_body, inline_images):
+    soup = BeautifulSoup(html_body, 'lxml')
+    # Inline CID replacements
+    if inline_images:
+        for img_tag in soup.find_all('img'):
+            src = img_tag.get('src')
+            if src and src.startswith('cid:'):
+                cid = src[4:]
+                if cid in inline_images:
+                    img_tag['src'] = inline_images[cid]
+    # Common lazy-load attributes → src and fix protocol-relative URLs
+    for img_tag in soup.find_all('img'):
+        if not img_tag.get('src'):
+            for attr in ['data-src', 'data-original', 'data-lazy-src']:
+                if img_tag.get(attr):
+                    img_tag['src'] = img_tag.get(attr)
+                    break
+        src_val = img_tag.get('src')
+        if src_val and src_val.startswith('//'):
+            img_tag['src'] = 'https:' + src_val
+        # Ensure images scale within the view
+        style = img_tag.get('style', '')
+        if 'max-width' not in style:
+            img_tag['style'] = (style + '; max-width: 100%; height: auto;').strip(';')
+    return str(soup)
+
 class ImapHandler:
     def __init__(self, host, user, password):
         self.host, self.user, self.password = host, user, password
         self.imap, self.is_connected = None, False
+        self.selected_folder = None
+        self._lock = asyncio.Lock()
 
+    @retry()
     async def connect(self):
+        # Only the explicit connect retries on its own; operations reconnect through
+        # _connect and are retried as a whole, so retry layers never multiply.
+        await self._connect()
+
+    async def _connect(self):
         def _blocking_connect():
             original_timeout = socket.getdefaulttimeout()
             socket.setdefaulttimeout(15) # 15-second timeout for all socket operations
@@ -46,11 +250,29 @@ class ImapHandler:
         except (imaplib.IMAP4.error, socket.gaierror, socket.timeout) as e:
             self.is_connected = False
             log.error(f"IMAP connection failed: {e}", exc_info=True)
-            raise EmailServiceError(f"IMAP connection failed. Check credentials and server address. Error: {e}")
+            raise EmailServiceError(f"IMAP connection failed. Check credentials and server address. Error: {e}") from e
 
     async def _ensure_connected(self):
         if not self.is_connected:
-            await self.connect()
+            await self._connect()
+            # A fresh session starts unselected; restore the folder later commands rely on.
+            if self.selected_folder:
+                await asyncio.get_running_loop().run_in_executor(None, self.imap.select, f'"{self.selected_folder}"', True)
+
+    async def _select(self, folder_name):
+        if folder_name != self.selected_folder:
+            await asyncio.get_running_loop().run_in_executor(None, self.imap.select, f'"{folder_name}"', True)
+            self.selected_folder = folder_name
+
+    async def _reset_connection(self):
+        # The old session is unusable after an abort/timeout; drop it without a LOGOUT round-trip.
+        self.is_connected = False
+        if self.imap:
+            try:
+                self.imap.shutdown()
+            except Exception:
+                pass
+            self.imap = None
 
     async def disconnect(self):
         if not self.imap:
@@ -78,6 +300,7 @@ class ImapHandler:
         finally:
             self.is_connected = False
 
+    @_serialized
     async def list_folders(self):
         await self._ensure_connected()
         log.info("Fetching folder list from IMAP server...")
@@ -102,13 +325,18 @@ class ImapHandler:
         except (imaplib.IMAP4.error, socket.timeout) as e:
             raise EmailServiceError(f"Could not list folders: {e}")
             
+    @retry()
+    @_serialized
     async def get_all_uids_in_folder(self, folder_name):
         await self._ensure_connected()
         await asyncio.get_running_loop().run_in_executor(None, self.imap.select, f'"{folder_name}"', True)
+        self.selected_folder = folder_name
         # Use UID SEARCH to get stable unique identifiers
         _st, messages = await asyncio.get_running_loop().run_in_executor(None, self.imap.uid, 'SEARCH', None, 'ALL')
         return [uid.decode() for uid in messages[0].split()]
 
+    @retry()
+    @_serialized
     async def fetch_email_headers(self, folder_name, uids_to_fetch):
         if not uids_to_fetch: return []
         await self._ensure_connected()
@@ -131,12 +359,118 @@ class ImapHandler:
                 uid_map[uid] = {'uid': uid, 'from': from_d, 'subject': subj_d, 'date': msg['Date']}
         return [uid_map[uid] for uid in uids_to_fetch if uid in uid_map]
 
+    @retry()
+    @_serialized
     async def fetch_full_email(self, uid):
         await self._ensure_connected()
-        # Use UID FETCH for message retrieval as well
+        loop = asyncio.get_running_loop()
+        # Look at the MIME structure first so only the text parts are downloaded up front;
+        # attachments are fetched on demand from their 'location' via fetch_part.
+        _status, data = await loop.run_in_executor(None, self.imap.uid, 'FETCH', uid, '(BODYSTRUCTURE)')
+        if not data or data[0] is None:
+            raise EmailServiceError(f"No data returned for UID {uid}.")
+        try:
+            leaves = list(_walk_bodystructure(_fetch_items(data)['BODYSTRUCTURE']))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            log.warning(f"Could not parse BODYSTRUCTURE for UID {uid} ({e}); fetching the full message.")
+            return await self._fetch_full_email_rfc822(uid)
+
+        qumail_part = next((p for p in leaves if p['content_type'] == 'application/x-qumail-json'), None)
+        parts = {'attachments': [], 'inlines': [], 'html_candidates': [], 'plain_candidates': []}
+        if not qumail_part:
+            for part in leaves:
+                if part['disposition'] == 'attachment' or (part['filename'] and part['content_type'] not in ('text/plain', 'text/html')):
+                    parts['attachments'].append(part)
+                elif part['disposition'] == 'inline' or part['content_id']:
+                    parts['inlines'].append(part)
+                elif part['content_type'] == 'text/html':
+                    parts['html_candidates'].append(part)
+                elif part['content_type'] == 'text/plain':
+                    parts['plain_candidates'].append(part)
+        html_part = next(iter(parts['html_candidates']), None)
+        plain_part = None if html_part else next(iter(parts['plain_candidates']), None)
+        wanted = [p for p in (qumail_part, html_part, plain_part) if p]
+        if html_part:
+            wanted += [p for p in parts['inlines'] if p['content_id']]
+
+        sections = ''.join(f" BODY.PEEK[{p['section']}]" for p in wanted)
+        _status, data = await loop.run_in_executor(None, self.imap.uid, 'FETCH', uid, f'(BODY.PEEK[HEADER]{sections})')
+        # Yield before the (potentially long) MIME/HTML processing so a cancelled selection stops here.
+        await asyncio.sleep(0)
+        try:
+            items = _fetch_items(data)
+        except (ValueError, IndexError) as e:
+            log.warning(f"Could not parse partial fetch for UID {uid} ({e}); fetching the full message.")
+            return await self._fetch_full_email_rfc822(uid)
+        payload = lambda p: _decode_transfer(items.get(f"BODY[{p['section']}]") or b'', p['encoding'])
+        try:
+            body = payload(qumail_part or html_part or plain_part) if wanted else b''
+        except ValueError as e:
+            log.warning(f"Could not decode the body of UID {uid} ({e}); fetching the full message.")
+            return await self._fetch_full_email_rfc822(uid)
+
+        msg = BytesParser().parsebytes(items.get('BODY[HEADER]') or b'', headersonly=True)
+        result = {'raw_message': msg, 'html_body': None, 'plain_body': None, 'attachments': []}
+        if qumail_part:
+            result['plain_body'] = body.decode('utf-8', 'ignore')
+            return result
+
+        folder = self.selected_folder
+        for part in parts['attachments']:
+            filename = part['filename']
+            if filename:
+                try:
+                    filename = str(make_header(decode_header(filename)))
+                except Exception:
+                    pass
+                result['attachments'].append({
+                    'filename': filename, 'size': part['size'], 'content': None,
+                    'location': (folder, uid, part['section'], part['encoding']),
+                })
+
+        if html_part:
+            inline_images = {}
+            for part in parts['inlines']:
+                if cid := part['content_id']:
+                    try:
+                        b64_data = base64.b64encode(payload(part)).decode('utf-8')
+                    except ValueError as e:
+                        log.warning(f"Skipping undecodable inline part {part['section']} of UID {uid}: {e}")
+                        continue
+                    inline_images[cid.strip()[1:-1]] = f"data:{part['content_type']};base64,{b64_data}"
+            html_body = _decode_text(body, html_part['charset'])
+            result['html_body'] = _rewrite_html(html_body, inline_images) if html_body else html_body
+        elif plain_part:
+            result['plain_body'] = _decode_text(body, plain_part['charset'])
+        return result
+
+    @retry()
+    @_serialized
+    async def fetch_part(self, folder_name, uid, section, encoding):
+        """Downloads and decodes a single MIME part (e.g. a deferred attachment)."""
+        try:
+            await self._ensure_connected()
+            previous_folder = self.selected_folder
+            await self._select(folder_name)
+            try:
+                _status, data = await asyncio.get_running_loop().run_in_executor(
+                    None, self.imap.uid, 'FETCH', uid, f'(BODY.PEEK[{section}])'
+                )
+            finally:
+                if previous_folder:
+                    await self._select(previous_folder)
+            content = _fetch_items(data).get(f"BODY[{section}]")
+            if content is None:
+                raise EmailServiceError(f"No data returned for part {section} of UID {uid}.")
+            return _decode_transfer(content, encoding)
+        except (imaplib.IMAP4.error, OSError, ValueError) as e:
+            raise EmailServiceError(f"Could not download part {section} of UID {uid}: {e}") from e
+
+    async def _fetch_full_email_rfc822(self, uid):
         _status, data = await asyncio.get_running_loop().run_in_executor(None, self.imap.uid, 'FETCH', uid, '(RFC822)')
         if not data or data[0] is None:
             raise EmailServiceError(f"No data returned for UID {uid}.")
+        await asyncio.sleep(0)
         msg = BytesParser().parsebytes(data[0][1])
         result = {'raw_message': msg, 'html_body': None, 'plain_body': None, 'attachments': []}
             
@@ -181,36 +515,64 @@ class ImapHandler:
             if plain_part: result['plain_body'] = plain_part.get_payload(decode=True).decode(plain_part.get_content_charset() or 'utf-8', 'ignore')
         
         if result['html_body']:
-            soup = BeautifulSoup(result['html_body'], 'lxml')
-            # Inline CID replacements
-            if inline_images:
-                for img_tag in soup.find_all('img'):
-                    src = img_tag.get('src')
-                    if src and src.startswith('cid:'):
-                        cid = src[4:]
-                        if cid in inline_images:
-                            img_tag['src'] = inline_images[cid]
-            # Common lazy-load attributes → src and fix protocol-relative URLs
-            for img_tag in soup.find_all('img'):
-                if not img_tag.get('src'):
-                    for attr in ['data-src', 'data-original', 'data-lazy-src']:
-                        if img_tag.get(attr):
-                            img_tag['src'] = img_tag.get(attr)
-                            break
-                src_val = img_tag.get('src')
-                if src_val and src_val.startswith('//'):
-                    img_tag['src'] = 'https:' + src_val
-                # Ensure images scale within the view
-                style = img_tag.get('style', '')
-                if 'max-width' not in style:
-                    img_tag['style'] = (style + '; max-width: 100%; height: auto;').strip(';')
-            result['html_body'] = str(soup)
+            result['html_body'] = _rewrite_html(result['html_body'], inline_images)
         
         return result
 
+class _SMTPSession(smtplib.SMTP_SSL):
+    # Once DATA has started the server may have queued the message even if its
+    # reply never arrives, so a lost connection past this point must not be retried.
+    body_sent = False
+
+    def data(self, msg):
+        self.body_sent = True
+        return super().data(msg)
+
 class SmtpHandler:
     def __init__(self, host, port, user, password):
         self.host, self.port, self.user, self.password = host, int(port), user, password
+        # One long-lived authenticated session, shared by all sends and
+        # re-established only when the server drops it.
+        self._smtp = None
+        self._lock = asyncio.Lock()
+
+    async def ensure_connected(self):
+        # Opens and authenticates the SMTP session ahead of time so callers can
+        # overlap the TLS handshake + LOGIN with other work (e.g. key fetches).
+        async with self._lock:
+            await self._connect_if_needed()
+
+    async def _connect_if_needed(self):
+        if self._smtp is None:
+            self._smtp = await asyncio.get_running_loop().run_in_executor(None, self._connect_blocking)
+
+    def _connect_blocking(self):
+        try:
+            log.info(f"Opening SMTP session to {self.host}:{self.port}...")
+            server = _SMTPSession(self.host, self.port, timeout=15)
+            server.login(self.user, self.password)
+            return server
+        except (smtplib.SMTPException, TimeoutError, socket.gaierror) as e:
+            raise EmailServiceError(f"Could not connect to SMTP server: {e}") from e
+
+    async def disconnect(self):
+        async with self._lock:
+            await self._drop_session()
+
+    async def _drop_session(self):
+        server, self._smtp = self._smtp, None
+        if server is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(None, server.quit), timeout=5)
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    async def _reset_connection(self):
+        await self.disconnect()
 
     async def send_email(self, to_addr, subject, body, from_addr, attachments=[]):
         is_qumail = "qumail_version" in body
@@ -233,13 +595,29 @@ class SmtpHandler:
                 msg.attach(part)
         
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, self._send_email_blocking, msg)
+        async with self._lock:
+            await self._connect_if_needed()
+            try:
+                await loop.run_in_executor(None, self._send_email_blocking, self._smtp, msg)
+            except (smtplib.SMTPServerDisconnected, TimeoutError) as e:
+                body_sent = self._smtp.body_sent
+                await self._drop_session()
+                if body_sent:
+                    raise EmailServiceError(f"Connection lost after the message was transmitted; it may already have been delivered: {e}") from e
+                # Idle sessions get dropped by the server; reconnect and retry once.
+                log.warning(f"SMTP session lost ({e}), reconnecting...")
+                await self._connect_if_needed()
+                try:
+                    await loop.run_in_executor(None, self._send_email_blocking, self._smtp, msg)
+                except (smtplib.SMTPServerDisconnected, TimeoutError) as e:
+                    await self._drop_session()
+                    raise EmailServiceError(f"Could not send email: {e}") from e
 
-    def _send_email_blocking(self, msg):
+    def _send_email_blocking(self, server, msg):
+        server.body_sent = False
         try:
-            with smtplib.SMTP_SSL(self.host, self.port, timeout=15) as server:
-                server.login(self.user, self.password)
-                server.send_message(msg)
-        except (smtplib.SMTPException, TimeoutError, socket.gaierror) as e:
+            server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, TimeoutError):
+            raise
+        except (smtplib.SMTPException, socket.gaierror) as e:
             raise EmailServiceError(f"Could not send email: {e}")
-
@@ -1,23 +1,37 @@
 # firebase_directory.py
 import httpx
 import asyncio
+import functools
 import logging
+import orjson
+import time
 
 log = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=1024)
+def safe_email(email: str) -> str:
+    """Encode an email address as a Firebase key (keys may not contain '.')"""
+    return email.replace('.', '(dot)')
+
+
 class FirebaseDirectory:
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, client: httpx.AsyncClient | None = None):
         self.database_url = database_url.rstrip('/')
-        self.client = httpx.AsyncClient(timeout=10.0)
+        # A client passed in is shared with its owner, who is responsible for closing it
+        self._owns_client = client is None
+        self.client = client if client is not None else httpx.AsyncClient(timeout=10.0)
+        # Public keys rarely change within a session; cache them and collapse concurrent lookups
+        self._key_cache: dict[str, tuple[float, str]] = {}
+        self._key_cache_ttl = 600
+        self._inflight: dict[str, asyncio.Task] = {}
 
     async def close(self):
-        if not self.client.is_closed:
+        if self._owns_client and not self.client.is_closed:
             await self.client.aclose()
 
     def _key_path(self, email: str) -> str:
-        safe_email = email.replace('.', '(dot)')
-        return f"{self.database_url}/pqc_public_keys/{safe_email}.json"
+        return f"{self.database_url}/pqc_public_keys/{safe_email(email)}.json"
 
     async def publish_public_key(self, email: str, public_key_b64: str) -> None:
         url = self._key_path(email)
@@ -25,19 +39,35 @@ class FirebaseDirectory:
         try:
             resp = await self.client.put(url, json=payload)
             resp.raise_for_status()
-            log.info(f"Published public key for {email} to Firebase.")
+            self._key_cache.pop(email, None)
+            log.info("Published public key for %s to Firebase.", email)
         except httpx.HTTPError as e:
             log.error(f"Failed to publish public key to Firebase: {e}", exc_info=True)
             raise
 
     async def fetch_public_key(self, email: str) -> str | None:
+        cached = self._key_cache.get(email)
+        if cached and time.monotonic() - cached[0] < self._key_cache_ttl:
+            return cached[1]
+
+        task = self._inflight.get(email)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_public_key(email))
+            self._inflight[email] = task
+            task.add_done_callback(lambda _: self._inflight.pop(email, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_public_key(self, email: str) -> str | None:
         url = self._key_path(email)
         try:
             resp = await self.client.get(url)
             resp.raise_for_status()
-            data = resp.json()
+            data = orjson.loads(resp.content)
             if isinstance(data, dict):
-                return data.get("public_key_b64")
+                public_key_b64 = data.get("public_key_b64")
+                if public_key_b64:
+                    self._key_cache[email] = (time.monotonic(), public_key_b64)
+                return public_key_b64
             return None
         except httpx.HTTPError as e:
             log.error(f"Failed to fetch public key from Firebase: {e}", exc_info=True)
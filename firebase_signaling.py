@@ -1,14 +1,66 @@
 # firebase_signaling.py
 import asyncio
+import functools
 import logging
-import json
+import orjson
+import random
 import time
-from typing import Dict, Optional, Callable
-from firebase_directory import FirebaseDirectory
-from PyQt6.QtCore import QObject, pyqtSignal # Use PyQt6 imports
+from collections import defaultdict
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Callable
+import httpx
+from firebase_directory import FirebaseDirectory, safe_email
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal # Use PyQt6 imports
 
 log = logging.getLogger(__name__)
 
+# Outbound messages are coalesced for this long into one multi-path PATCH
+SEND_BATCH_WINDOW = 0.02
+# Latency-critical messages skip the batch queue and are POSTed immediately
+IMMEDIATE_MESSAGE_TYPES = frozenset({'call_initiation', 'call_answer'})
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Incoming ICE candidates for a call are coalesced for this long before being emitted
+ICE_BATCH_INTERVAL_MS = 30
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+_last_push_time = 0
+_last_rand_chars = [0] * 12
+
+def generate_push_id() -> str:
+    """Generate a chronologically sortable Firebase push ID client-side"""
+    global _last_push_time
+    now = int(time.time() * 1000)
+    duplicate_time = now == _last_push_time
+    _last_push_time = now
+
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    push_id = ''.join(reversed(time_chars))
+
+    if not duplicate_time:
+        for i in range(12):
+            _last_rand_chars[i] = random.randrange(64)
+    else:
+        # Same millisecond: increment the random suffix so IDs stay ordered
+        i = 11
+        while i >= 0 and _last_rand_chars[i] == 63:
+            _last_rand_chars[i] = 0
+            i -= 1
+        if i >= 0:
+            _last_rand_chars[i] += 1
+
+    return push_id + ''.join(PUSH_CHARS[c] for c in _last_rand_chars)
+
+@functools.lru_cache(maxsize=128)
+def _target_url(database_url: str, target_user: str) -> str:
+    return f"{database_url}/signaling_messages/{safe_email(target_user)}.json"
+
+def _message_order(message: dict):
+    # Messages from older clients have no server_time and sort first, by their own timestamp
+    return (message.get('server_time') or 0, message.get('timestamp', 0))
+
 class FirebaseSignaling(QObject):
     """Firebase-based signaling server for cross-device WebRTC calls"""
     
@@ -20,24 +72,39 @@ class FirebaseSignaling(QObject):
     offer_received = pyqtSignal(str, dict)
     answer_received = pyqtSignal(str, dict)
     ice_candidate_received = pyqtSignal(str, dict)
+    ice_candidates_batch = pyqtSignal(str, list)
     quantum_key_requested = pyqtSignal(str, str)
     
     def __init__(self, database_url: str = "https://qu--mail-default-rtdb.firebaseio.com"):
         super().__init__()  # Initialize the QObject parent class
         self.database_url = database_url.rstrip('/')
-        self.firebase = FirebaseDirectory(database_url)
         self.current_user = ""
+        self._inbox_url = ""
+        # Highest server_time seen, so polling only pulls messages newer than that
+        self._last_server_time = 0
+        # Cleared when the database has no server_time index, so polling reads the whole inbox
+        self._server_ordering = True
         self.is_connected = False
-        self.message_handlers: Dict[str, Callable] = {}
         self.active_calls: Dict[str, Dict] = {}
         self.listen_task: Optional[asyncio.Task] = None
-        
-        # Setup message handlers
-        self.setup_handlers()
+        self._stop = asyncio.Event()
+        self._http = self._create_http_client()
+        # Directory lookups share the signaling connection pool
+        self.firebase = FirebaseDirectory(database_url, client=self._http)
+        self._send_queue: list[tuple[str, dict]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._immediate_send: Optional[asyncio.Task] = None
+        # Fire-and-forget sends still in flight, so disconnect can let them finish before closing the client
+        self._pending_sends: set[asyncio.Task] = set()
+        # Set to emit ice_candidate_received once per candidate instead of batching
+        self.emit_single_ice_candidates = False
+        self._ice_buffer: Dict[str, list] = defaultdict(list)
+        self._ice_timers: Dict[str, QTimer] = {}
     
-    def setup_handlers(self):
-        """Setup message type handlers"""
-        self.message_handlers = {
+    @functools.cached_property
+    def message_handlers(self) -> Dict[str, Callable]:
+        """Message type handlers, bound once on first dispatch"""
+        return {
             'call_initiation': self.handle_call_initiation,
             'call_answer': self.handle_call_answer,
             'call_end': self.handle_call_end,
@@ -50,10 +117,25 @@ class FirebaseSignaling(QObject):
             'user_offline': self.handle_user_offline
         }
     
+    @staticmethod
+    def _create_http_client() -> httpx.AsyncClient:
+        """Persistent client so every signal reuses a warm HTTP/2 connection"""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            http2=True,
+        )
+
     async def connect(self, user_email: str):
         """Connect to Firebase signaling"""
         self.current_user = user_email
+        self._inbox_url = _target_url(self.database_url, user_email)
+        self._last_server_time = 0
         self.is_connected = True
+        self._stop.clear()
+        if self._http.is_closed:
+            self._http = self._create_http_client()
+            self.firebase.client = self._http
         
         # Start listening for messages
         self.listen_task = asyncio.create_task(self.listen_for_messages())
@@ -65,7 +147,7 @@ class FirebaseSignaling(QObject):
             'timestamp': time.time()
         }, user_email)
         
-        log.info(f"Connected to Firebase signaling as {user_email}")
+        log.info("Connected to Firebase signaling as %s", user_email)
     
     async def disconnect(self):
         """Disconnect from Firebase signaling"""
@@ -79,7 +161,14 @@ class FirebaseSignaling(QObject):
                 'timestamp': time.time()
             }, self.current_user)
         
-        # Cancel listen task
+        # Deliver anything still waiting in the batch queue, and any optimistic sends in flight
+        if self._pending_sends:
+            await asyncio.gather(*self._pending_sends, return_exceptions=True)
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        
+        # Wake the listener immediately, then cancel it out of any open stream read
+        self._stop.set()
         if self.listen_task:
             self.listen_task.cancel()
             try:
@@ -87,41 +176,110 @@ class FirebaseSignaling(QObject):
             except asyncio.CancelledError:
                 pass
         
-        # Close Firebase connection
+        # Close Firebase connections
         await self.firebase.close()
+        if not self._http.is_closed:
+            await self._http.aclose()
         
-        log.info(f"Disconnected from Firebase signaling")
+        log.info("Disconnected from Firebase signaling")
     
     async def listen_for_messages(self):
-        """Listen for incoming messages from Firebase"""
-        while self.is_connected:
+        """Listen for incoming messages, streaming from Firebase and polling as a fallback"""
+        max_delay = 30
+        failures = 0
+        while not self._stop.is_set():
             try:
-                messages = await self.get_user_messages_and_clear()
-                
-                for message in messages:
-                    await self.process_message(message)
-                
-                await asyncio.sleep(1) # Polling interval
-                
+                await self.stream_messages()
+                failures = 0
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                log.error(f"Error listening for messages: {e}")
-                await asyncio.sleep(5)  # Wait longer on error
-    
+                failures += 1
+                log.warning(f"Signaling stream failed (attempt {failures}), falling back to polling: {e}")
+                try:
+                    messages = await self.get_user_messages_and_clear()
+                    await self.process_messages(messages)
+                except Exception as e:
+                    log.error(f"Error polling for messages: {e}")
+                # Exponential backoff, cut short as soon as we are told to stop
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=min(max_delay, 2 ** (failures - 1)))
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+    async def stream_messages(self):
+        """Consume the Firebase REST event stream for the current user's message queue"""
+        url = self._inbox_url
+
+        timeout = httpx.Timeout(10.0, connect=5.0, read=None)
+        async with self._http.stream("GET", url, headers={"Accept": "text/event-stream"},
+                                     timeout=timeout, follow_redirects=True) as response:
+            response.raise_for_status()
+            log.debug("Signaling stream open for %s", self.current_user)
+
+            event = None
+            async for line in response.aiter_lines():
+                if self._stop.is_set():
+                    return
+                if line.startswith('event:'):
+                    event = line[6:].strip()
+                elif line.startswith('data:') and event:
+                    await self.handle_stream_event(event, line[5:].strip())
+                    event = None
+
+    async def handle_stream_event(self, event: str, data: str):
+        """Dispatch a single put/patch event from the signaling stream"""
+        if event in ('cancel', 'auth_revoked'):
+            raise ConnectionError(f"Signaling stream closed by server: {event}")
+        if event not in ('put', 'patch'):
+            return  # keep-alive
+
+        payload = orjson.loads(data)
+        path = payload.get('path', '/').strip('/')
+        body = payload.get('data')
+        if not body:
+            return  # Our own deletes echo back as null puts
+
+        if not path:
+            children = body if isinstance(body, dict) else {}
+        elif '/' not in path and event == 'put':
+            children = {path: body}
+        else:
+            return
+
+        messages = [(key, msg) for key, msg in children.items() if isinstance(msg, dict)]
+        if not messages:
+            return
+
+        # Delete the received children so a reconnect does not replay them
+        delete = asyncio.create_task(self._delete_children([key for key, _ in messages]))
+
+        await self.process_messages(sorted((msg for _, msg in messages), key=_message_order))
+
+        try:
+            await delete
+        except Exception as e:
+            log.warning(f"Failed to delete {len(messages)} signaling messages: {e}")
+
+    async def _delete_children(self, keys: list):
+        """Null out the given message keys in one multi-path PATCH, leaving any newer messages alone"""
+        response = await self._http.patch(self._inbox_url, content=orjson.dumps(dict.fromkeys(keys)), headers=JSON_HEADERS)
+        response.raise_for_status()
+
     async def get_user_messages(self) -> list:
         """Get messages for current user from Firebase"""
         try:
-            import httpx
-            url = f"{self.database_url}/signaling_messages/{self.current_user.replace('.', '(dot)')}.json"
+            url = self._inbox_url
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
-                if response.status_code == 200:
-                    data = response.json()
-                    if data:
-                        # Convert to list and sort by timestamp
-                        messages = list(data.values()) if isinstance(data, dict) else []
-                        return sorted(messages, key=lambda x: x.get('timestamp', 0))
-                return []
+            response = await self._http.get(url)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                if data:
+                    # Convert to list and sort by timestamp
+                    messages = list(data.values()) if isinstance(data, dict) else []
+                    return sorted(messages, key=_message_order)
+            return []
         except Exception as e:
             log.error(f"Error getting user messages: {e}")
             return []
@@ -133,27 +291,27 @@ class FirebaseSignaling(QObject):
         
         for attempt in range(max_retries):
             try:
-                import httpx
-                url = f"{self.database_url}/signaling_messages/{self.current_user.replace('.', '(dot)')}.json"
+                url = self._inbox_url
                 
-                # Use longer timeout and connection pooling
-                timeout = httpx.Timeout(10.0, connect=5.0)
-                async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=10)) as client:
-                    # Get messages
-                    response = await client.get(url)
-                    response.raise_for_status()
-                    data = response.json()
-                    
-                    messages = []
-                    if data:
-                        messages = list(data.values()) if isinstance(data, dict) else []
-                        
-                        # Immediately delete messages to prevent reprocessing
-                        delete_response = await client.delete(url)
-                        delete_response.raise_for_status()
-                        log.debug(f"Cleared messages for {self.current_user} from Firebase.")
-
-                    return sorted(messages, key=lambda x: x.get('timestamp', 0))
+                # Cheap probe: shallow=true returns only the child keys, so an idle inbox costs a few bytes
+                probe = await self._http.get(url, params={'shallow': 'true'})
+                probe.raise_for_status()
+                keys = orjson.loads(probe.content)
+                if not keys:
+                    return []
+                
+                items = await self._read_inbox(url, len(keys))
+                messages = [msg for _, msg in items if isinstance(msg, dict) and self._is_unseen(msg)]
+                if items:
+                    # Delete exactly the children we read, so a message written since the GET is kept
+                    await self._delete_children([key for key, _ in items])
+                    log.debug("Cleared %s messages for %s from Firebase.", len(items), self.current_user)
+
+                # orderBy normally returns keys in order; only sort if this response was not
+                order = [_message_order(m) for m in messages]
+                if any(a > b for a, b in zip(order, order[1:])):
+                    messages.sort(key=_message_order)
+                return messages
                     
             except httpx.HTTPStatusError as e:
                 if e.response.status_code == 404: # No messages, not an error
@@ -177,6 +335,46 @@ class FirebaseSignaling(QObject):
         
         return []
     
+    async def _read_inbox(self, url: str, expected: int) -> list:
+        """Read unseen inbox children as (key, message) pairs, server-ordered when the database allows it"""
+        if self._server_ordering:
+            params = {'orderBy': '"server_time"', 'startAt': self._last_server_time}
+            response = await self._http.get(url, params=params)
+            if response.status_code == 400:
+                # Firebase rejects orderBy without ".indexOn": ["server_time"] on signaling_messages (see README)
+                log.warning("No server_time index on signaling_messages; polling the whole inbox instead.")
+                self._server_ordering = False
+            else:
+                response.raise_for_status()
+                data = orjson.loads(response.content)
+                items = list(data.items()) if isinstance(data, dict) else []
+                # startAt skips children without server_time (older clients); fetch everything to pick those up
+                if len(items) >= expected:
+                    return items
+
+        response = await self._http.get(url)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        return list(data.items()) if isinstance(data, dict) else []
+
+    def _is_unseen(self, message: dict) -> bool:
+        server_time = message.get('server_time')
+        return not isinstance(server_time, (int, float)) or server_time >= self._last_server_time
+
+    async def process_messages(self, messages: list):
+        """Process a batch concurrently across calls, keeping order within each call"""
+        by_call: Dict[Optional[str], list] = defaultdict(list)
+        for message in messages:
+            server_time = message.get('server_time')
+            if isinstance(server_time, (int, float)) and server_time > self._last_server_time:
+                self._last_server_time = server_time
+            by_call[message.get('call_id')].append(message)
+        await asyncio.gather(*(self._process_serial(group) for group in by_call.values()))
+
+    async def _process_serial(self, messages: list):
+        for message in messages:
+            await self.process_message(message)
+
     async def process_message(self, message: dict):
         """Process a received message"""
         try:
@@ -188,29 +386,77 @@ class FirebaseSignaling(QObject):
         except Exception as e:
             log.error(f"Error processing message: {e}")
     
-    async def send_message(self, message: dict, target_user: str):
-        """Send a message via Firebase to a specific user"""
+    async def send_message(self, message: dict, target_user: str) -> bool:
+        """Send a message via Firebase to a specific user; False if an immediate send failed"""
+        # Add timestamp and sender; server_time is filled in by Firebase so every inbox orders on one clock
+        message['timestamp'] = time.time()
+        message['server_time'] = {'.sv': 'timestamp'}
+        message['from'] = self.current_user
+        message['to'] = target_user
+
+        if message.get('type') in IMMEDIATE_MESSAGE_TYPES:
+            return await self._post_message(message, target_user)
+
+        self._send_queue.append((target_user, message))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_send_queue())
+        return True
+
+    def _send_optimistic(self, message: dict, target_user: str, call_id: str = None) -> asyncio.Task:
+        """Send without waiting for Firebase; if call_id is given, its local state is rolled back on failure"""
+        task = asyncio.create_task(self.send_message(message, target_user))
+        self._pending_sends.add(task)
+        task.add_done_callback(self._pending_sends.discard)
+        if message['type'] in IMMEDIATE_MESSAGE_TYPES:
+            self._immediate_send = task
+        if call_id:
+            task.add_done_callback(functools.partial(self._on_send_complete, call_id))
+        return task
+
+    def _on_send_complete(self, call_id: str, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None and task.result():
+            return
+        log.warning(f"Signaling for call {call_id} was not delivered, rolling back local call state")
+        if self.active_calls.pop(call_id, None) is not None:
+            self.call_ended.emit(call_id)
+
+    async def _post_message(self, message: dict, target_user: str):
+        """POST a single message straight to the target user's queue"""
         try:
-            import httpx
-            
-            # Add timestamp and sender
-            message['timestamp'] = time.time()
-            message['from'] = self.current_user
-            message['to'] = target_user
-            
             # Send to target user's message queue
-            target_path = target_user.replace('.', '(dot)')
-            url = f"{self.database_url}/signaling_messages/{target_path}.json"
+            url = _target_url(self.database_url, target_user)
             
-            async with httpx.AsyncClient() as client:
-                # Use POST to let Firebase generate a unique message ID
-                response = await client.post(url, json=message)
-                response.raise_for_status()
-                
-                log.debug(f"Sent message {message['type']} to {target_user}")
+            # Use POST to let Firebase generate a unique message ID
+            response = await self._http.post(url, content=orjson.dumps(message), headers=JSON_HEADERS)
+            response.raise_for_status()
+            
+            log.debug("Sent message %s to %s", message['type'], target_user)
+            return True
                 
         except Exception as e:
             log.error(f"Error sending message to {target_user}: {e}")
+            return False
+
+    async def _flush_send_queue(self):
+        """Write every queued message in a single multi-path PATCH"""
+        await asyncio.sleep(SEND_BATCH_WINDOW)
+        # Keep batched messages behind a call setup message that is still in flight
+        if self._immediate_send and not self._immediate_send.done():
+            await asyncio.wait([self._immediate_send])
+        batch, self._send_queue = self._send_queue, []
+        if not batch:
+            return
+
+        updates = {
+            f"{safe_email(target_user)}/{generate_push_id()}": message
+            for target_user, message in batch
+        }
+        try:
+            response = await self._http.patch(f"{self.database_url}/signaling_messages.json", content=orjson.dumps(updates), headers=JSON_HEADERS)
+            response.raise_for_status()
+            log.debug("Sent %s batched signaling messages", len(batch))
+        except Exception as e:
+            log.error(f"Error sending {len(batch)} batched signaling messages: {e}")
     
     async def initiate_call(self, call_id: str, target_user: str, call_type: str, quantum_key_id: str = None):
         """Initiate a call to another user"""
@@ -229,8 +475,8 @@ class FirebaseSignaling(QObject):
             'timestamp': time.time()
         }
         
-        await self.send_message(message, target_user)
-        log.info(f"Call {call_id} initiated to {target_user}")
+        self._send_optimistic(message, target_user, call_id)
+        log.info("Call %s initiated to %s", call_id, target_user)
     
     async def answer_call(self, call_id: str, target_user: str):
         """Answer an incoming call"""
@@ -242,8 +488,8 @@ class FirebaseSignaling(QObject):
         if call_id in self.active_calls:
             self.active_calls[call_id]['status'] = 'answered'
         
-        await self.send_message(message, target_user)
-        log.info(f"Call {call_id} answered")
+        self._send_optimistic(message, target_user, call_id)
+        log.info("Call %s answered", call_id)
     
     async def end_call(self, call_id: str, target_user: str = None):
         """End a call"""
@@ -259,9 +505,9 @@ class FirebaseSignaling(QObject):
             del self.active_calls[call_id]
         
         if target_user:
-            await self.send_message(message, target_user)
+            self._send_optimistic(message, target_user)
         
-        log.info(f"Call {call_id} ended")
+        log.info("Call %s ended", call_id)
     
     async def send_offer(self, call_id: str, target_user: str, offer: dict):
         """Send WebRTC offer"""
@@ -271,8 +517,8 @@ class FirebaseSignaling(QObject):
             'offer': offer
         }
         
-        await self.send_message(message, target_user)
-        log.debug(f"Offer sent for call {call_id}")
+        self._send_optimistic(message, target_user)
+        log.debug("Offer sent for call %s", call_id)
     
     async def send_answer(self, call_id: str, target_user: str, answer: dict):
         """Send WebRTC answer"""
@@ -282,8 +528,8 @@ class FirebaseSignaling(QObject):
             'answer': answer
         }
         
-        await self.send_message(message, target_user)
-        log.debug(f"Answer sent for call {call_id}")
+        self._send_optimistic(message, target_user)
+        log.debug("Answer sent for call %s", call_id)
     
     async def send_ice_candidate(self, call_id: str, target_user: str, candidate: dict):
         """Send ICE candidate"""
@@ -293,8 +539,9 @@ class FirebaseSignaling(QObject):
             'candidate': candidate
         }
         
-        await self.send_message(message, target_user)
-        log.debug(f"ICE candidate sent for call {call_id}")
+        self._send_optimistic(message, target_user)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("ICE candidate sent for call %s", call_id)
     
     async def request_quantum_key(self, call_id: str, target_user: str, quantum_key_id: str):
         """Request quantum key from target user"""
@@ -304,8 +551,8 @@ class FirebaseSignaling(QObject):
             'quantum_key_id': quantum_key_id
         }
         
-        await self.send_message(message, target_user)
-        log.debug(f"Quantum key request sent for call {call_id}")
+        self._send_optimistic(message, target_user)
+        log.debug("Quantum key request sent for call %s", call_id)
     
     # Message handlers
     async def handle_call_initiation(self, message: dict):
@@ -315,67 +562,86 @@ class FirebaseSignaling(QObject):
         call_type = message.get('call_type')
         quantum_key_id = message.get('quantum_key_id')
         
-        log.info(f"Incoming call {call_id} from {caller}")
+        log.info("Incoming call %s from %s", call_id, caller)
         
         # Emit signal for UI to handle
-        if hasattr(self, 'call_received'):
-            self.call_received.emit(call_id, caller, call_type, quantum_key_id)
+        self.call_received.emit(call_id, caller, call_type, quantum_key_id)
     
     async def handle_call_answer(self, message: dict):
         """Handle call answer"""
         call_id = message.get('call_id')
-        log.info(f"Call {call_id} answered")
+        log.info("Call %s answered", call_id)
         
-        if hasattr(self, 'call_answered'):
-            self.call_answered.emit(call_id)
+        self.call_answered.emit(call_id)
     
     async def handle_call_end(self, message: dict):
         """Handle call end"""
         call_id = message.get('call_id')
-        log.info(f"Call {call_id} ended")
+        log.info("Call %s ended", call_id)
         
         # Remove from active calls
         if call_id in self.active_calls:
             del self.active_calls[call_id]
         
-        if hasattr(self, 'call_ended'):
-            self.call_ended.emit(call_id)
+        timer = self._ice_timers.pop(call_id, None)
+        if timer:
+            timer.stop()
+            timer.deleteLater()
+        self._ice_buffer.pop(call_id, None)
+        
+        self.call_ended.emit(call_id)
     
     async def handle_offer(self, message: dict):
         """Handle WebRTC offer"""
         call_id = message.get('call_id')
         offer = message.get('offer')
-        log.debug(f"Received offer for call {call_id}")
+        log.debug("Received offer for call %s", call_id)
         
-        if hasattr(self, 'offer_received'):
-            self.offer_received.emit(call_id, offer)
+        self.offer_received.emit(call_id, offer)
     
     async def handle_answer(self, message: dict):
         """Handle WebRTC answer"""
         call_id = message.get('call_id')
         answer = message.get('answer')
-        log.debug(f"Received answer for call {call_id}")
+        log.debug("Received answer for call %s", call_id)
         
-        if hasattr(self, 'answer_received'):
-            self.answer_received.emit(call_id, answer)
+        self.answer_received.emit(call_id, answer)
     
     async def handle_ice_candidate(self, message: dict):
         """Handle ICE candidate"""
         call_id = message.get('call_id')
         candidate = message.get('candidate')
-        log.debug(f"Received ICE candidate for call {call_id}")
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Received ICE candidate for call %s", call_id)
         
-        if hasattr(self, 'ice_candidate_received'):
+        if self.emit_single_ice_candidates:
             self.ice_candidate_received.emit(call_id, candidate)
+            return
+        
+        self._ice_buffer[call_id].append(candidate)
+        timer = self._ice_timers.get(call_id)
+        if timer is None:
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.setInterval(ICE_BATCH_INTERVAL_MS)
+            timer.timeout.connect(lambda: self._flush_ice_candidates(call_id))
+            self._ice_timers[call_id] = timer
+        if not timer.isActive():
+            timer.start()
+    
+    def _flush_ice_candidates(self, call_id: str):
+        """Emit every ICE candidate buffered for a call in one signal"""
+        candidates = self._ice_buffer.pop(call_id, None)
+        if candidates:
+            self.ice_candidates_batch.emit(call_id, candidates)
     
     async def handle_quantum_key_request(self, message: dict):
         """Handle quantum key request"""
         call_id = message.get('call_id')
         quantum_key_id = message.get('quantum_key_id')
-        log.debug(f"Received quantum key request for call {call_id}")
+        log.debug("Received quantum key request for call %s", call_id)
         
-        if hasattr(self, 'quantum_key_requested'):
-            self.quantum_key_requested.emit(call_id, quantum_key_id)
+        self.quantum_key_requested.emit(call_id, quantum_key_id)
     
     async def handle_ping(self, message: dict):
         """Handle ping message"""
@@ -388,24 +654,22 @@ class FirebaseSignaling(QObject):
     async def handle_user_online(self, message: dict):
         """Handle user_online message"""
         user = message.get('user')
-        log.info(f"User {user} is online")
-        if hasattr(self, 'user_online'):
-            self.user_online.emit(user)
+        log.info("User %s is online", user)
+        self.user_online.emit(user)
     
     async def handle_user_offline(self, message: dict):
         """Handle user_offline message"""
         user = message.get('user')
-        log.info(f"User {user} is offline")
-        if hasattr(self, 'user_offline'):
-            self.user_offline.emit(user)
+        log.info("User %s is offline", user)
+        self.user_offline.emit(user)
     
     async def cleanup_old_messages(self):
         """No longer needed with get_user_messages_and_clear"""
         pass
     
-    def get_active_calls(self) -> Dict[str, Dict]:
-        """Get active calls"""
-        return self.active_calls.copy()
+    def get_active_calls(self) -> Mapping[str, Dict]:
+        """Get a read-only view of active calls"""
+        return MappingProxyType(self.active_calls)
     
     def is_in_call(self) -> bool:
         """Check if user is in any active call"""
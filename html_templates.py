@@ -3,17 +3,21 @@
 # This file contains professional-grade HTML templates for displaying
 # the state of secure messages and the email view pane to the user.
 
+import html
+import re
+from string import Template
+
 EMPTY_VIEW_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <style>
-        body {{
+        body {
             background-color: #3c3f41; /* Match the QTableWidget background */
             margin: 0;
             padding: 0;
-        }}
+        }
     </style>
 </head>
 <body>
@@ -29,7 +33,7 @@ LOCKED_MESSAGE_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <style>
-        body {{
+        body {
             font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
             background-color: #2E2E3A;
             color: #E0E0E0;
@@ -40,28 +44,28 @@ LOCKED_MESSAGE_TEMPLATE = """
             align-items: center;
             height: 100vh;
             box-sizing: border-box;
-        }}
-        .container {{
+        }
+        .container {
             text-align: center;
             max-width: 500px;
-        }}
-        .icon {{
+        }
+        .icon {
             font-size: 60px;
             margin-bottom: 20px;
             color: #70A5F5;
-        }}
-        h1 {{
+        }
+        h1 {
             font-size: 24px;
             font-weight: 600;
             margin-bottom: 10px;
             color: #FFFFFF;
-        }}
-        p {{
+        }
+        p {
             font-size: 16px;
             line-height: 1.6;
             color: #A0A0B0;
-        }}
-        .spinner {{
+        }
+        .spinner {
             border: 4px solid #4A4A5A;
             border-top: 4px solid #70A5F5;
             border-radius: 50%;
@@ -69,11 +73,11 @@ LOCKED_MESSAGE_TEMPLATE = """
             height: 40px;
             animation: spin 1s linear infinite;
             margin: 30px auto 0 auto;
-        }}
-        @keyframes spin {{
-            0% {{ transform: rotate(0deg); }}
-            100% {{ transform: rotate(360deg); }}
-        }}
+        }
+        @keyframes spin {
+            0% { transform: rotate(0deg); }
+            100% { transform: rotate(360deg); }
+        }
     </style>
 </head>
 <body>
@@ -94,7 +98,7 @@ DECRYPTION_FAILED_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <style>
-        body {{
+        body {
             font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
             background-color: #2E2E3A;
             color: #E0E0E0;
@@ -105,30 +109,30 @@ DECRYPTION_FAILED_TEMPLATE = """
             align-items: center;
             height: 100vh;
             box-sizing: border-box;
-        }}
-        .container {{
+        }
+        .container {
             text-align: center;
             max-width: 500px;
             border-left: 4px solid #D9534F;
             padding-left: 20px;
-        }}
-        .icon {{
+        }
+        .icon {
             font-size: 60px;
             margin-bottom: 20px;
             color: #D9534F;
-        }}
-        h1 {{
+        }
+        h1 {
             font-size: 24px;
             font-weight: 600;
             margin-bottom: 10px;
             color: #FFFFFF;
-        }}
-        p {{
+        }
+        p {
             font-size: 16px;
             line-height: 1.6;
             color: #A0A0B0;
-        }}
-        .error-details {{
+        }
+        .error-details {
             margin-top: 20px;
             padding: 15px;
             background-color: #3A3A4A;
@@ -138,7 +142,7 @@ DECRYPTION_FAILED_TEMPLATE = """
             color: #E0E0E0;
             text-align: left;
             word-wrap: break-word;
-        }}
+        }
     </style>
 </head>
 <body>
@@ -147,10 +151,30 @@ DECRYPTION_FAILED_TEMPLATE = """
         <h1>Decryption Failed</h1>
         <p>The message could not be decrypted. This may be due to a missing key, a tampered message, or an internal error.</p>
         <div class="error-details">
-            <strong>Error:</strong> {error_message}
+            <strong>Error:</strong> $error_message
         </div>
     </div>
 </body>
 </html>
 """
 
+
+# Collapse the indentation and line breaks once at import so the web view parses less
+_ws = re.compile(r'\s+')
+_between_tags = re.compile(r'>\s+<')
+
+def _minify(template: str) -> str:
+    return _between_tags.sub('><', _ws.sub(' ', template)).strip()
+
+EMPTY_VIEW_TEMPLATE = _minify(EMPTY_VIEW_TEMPLATE)
+LOCKED_MESSAGE_TEMPLATE = _minify(LOCKED_MESSAGE_TEMPLATE)
+DECRYPTION_FAILED_TEMPLATE = _minify(DECRYPTION_FAILED_TEMPLATE)
+
+# Parsed once at import; only the error span varies per render
+_DECRYPTION_FAILED = Template(DECRYPTION_FAILED_TEMPLATE)
+
+def render_decryption_failed(error_message) -> str:
+    return _DECRYPTION_FAILED.substitute(error_message=html.escape(str(error_message)))
+
+# Static view pre-encoded for QWebEngineView.setContent
+EMPTY_VIEW_BYTES = EMPTY_VIEW_TEMPLATE.encode('utf-8')
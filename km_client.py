@@ -1,7 +1,9 @@
 # km_client.py
 
+import asyncio
 import httpx
 import logging
+import orjson
 
 # --- Setup comprehensive logging ---
 log = logging.getLogger(__name__)
@@ -12,6 +14,13 @@ if not log.handlers:
     log.addHandler(handler)
     log.setLevel(logging.INFO)
 
+# Number of fresh keys kept ready so call setup does not wait on the Key Manager
+PREFETCH_POOL_SIZE = 4
+PREFETCH_RETRY_DELAY = 5
+PREFETCH_MAX_RETRY_DELAY = 60
+# After this many failures in a row the producer stops until an on-demand fetch succeeds
+PREFETCH_MAX_FAILURES = 5
+
 class KeyManagerError(Exception):
     """Custom exception for Key Manager client errors."""
     pass
@@ -25,13 +34,19 @@ class KMClient:
         self.slave_sae_id = slave_sae_id
         self.get_key_url = f"{self.base_url}/api/v1/keys/{self.slave_sae_id}/enc_keys"
         # --- FIX: Instantiate a persistent client for connection pooling ---
-        self.client = httpx.AsyncClient(timeout=10.0)
-        log.info(f"KMClient initialized for base URL: {self.base_url}")
+        self.client = httpx.AsyncClient(timeout=10.0, http2=True)
+        self._prefetch: asyncio.Queue = asyncio.Queue(maxsize=PREFETCH_POOL_SIZE)
+        self._producer_task = None
+        self._prefetch_paused = False
+        log.info("KMClient initialized for base URL: %s", self.base_url)
 
     async def fetch_key(self, key_id_to_fetch=None):
         """
         Asynchronously fetches a key from the Key Manager.
 
+        New keys are served from a background-filled pool when one is ready;
+        specific key IDs always go straight to the server.
+
         Args:
             key_id_to_fetch (str, optional): The specific ID of the key to fetch. 
                                             If None, fetches a new key.
@@ -42,12 +57,54 @@ class KMClient:
         Raises:
             KeyManagerError: If the key cannot be fetched or the response is invalid.
         """
+        if key_id_to_fetch:
+            return await self._fetch_one_from_server(key_id_to_fetch)
+
+        self._ensure_producer()
+        try:
+            return self._prefetch.get_nowait()
+        except asyncio.QueueEmpty:
+            key = await self._fetch_one_from_server()
+            if self._prefetch_paused:
+                # The Key Manager is reachable again
+                self._prefetch_paused = False
+                self._ensure_producer()
+            return key
+
+    def _ensure_producer(self):
+        if self._prefetch_paused:
+            return
+        if self._producer_task is None or self._producer_task.done():
+            self._producer_task = asyncio.create_task(self._fill_prefetch_pool())
+
+    async def _fill_prefetch_pool(self):
+        """Keeps the prefetch pool topped up with fresh keys until closed.
+
+        Failures back off exponentially; after PREFETCH_MAX_FAILURES in a row the producer
+        pauses so an unreachable Key Manager is not polled for the life of the app.
+        """
+        failures = 0
+        while not self.client.is_closed:
+            try:
+                key = await self._fetch_one_from_server()
+            except KeyManagerError:
+                failures += 1
+                if failures >= PREFETCH_MAX_FAILURES:
+                    log.warning("Key prefetch paused after %s failed attempts.", failures)
+                    self._prefetch_paused = True
+                    return
+                await asyncio.sleep(min(PREFETCH_MAX_RETRY_DELAY, PREFETCH_RETRY_DELAY * 2 ** (failures - 1)))
+                continue
+            failures = 0
+            await self._prefetch.put(key)
+
+    async def _fetch_one_from_server(self, key_id_to_fetch=None):
         request_url = self.get_key_url
         params = {'number': 1}
         if key_id_to_fetch:
             # The simulated server uses this param to find a specific key
             params['key_ID'] = key_id_to_fetch
-            log.info(f"Requesting specific key with ID: {key_id_to_fetch}")
+            log.info("Requesting specific key with ID: %s", key_id_to_fetch)
         else:
             log.info("Requesting a new key from the pool.")
 
@@ -56,13 +113,13 @@ class KMClient:
             response = await self.client.get(request_url, params=params)
             response.raise_for_status()  # Raises HTTPStatusError for 4xx/5xx responses
 
-            data = response.json()
+            data = orjson.loads(response.content)
             if "keys" in data and len(data["keys"]) > 0:
                 key_data = data["keys"][0]
                 key_id = key_data.get("key_ID")
                 key_hex = key_data.get("key")
                 if key_id and key_hex:
-                    log.info(f"Successfully fetched key with ID: {key_id}")
+                    log.info("Successfully fetched key with ID: %s", key_id)
                     return key_id, key_hex
             
             # If we reach here, the response format was invalid
@@ -89,6 +146,12 @@ class KMClient:
         Properly closes the underlying HTTP client session.
         """
         log.info("Closing Key Manager client's HTTP session...")
+        if self._producer_task and not self._producer_task.done():
+            self._producer_task.cancel()
+            try:
+                await self._producer_task
+            except asyncio.CancelledError:
+                pass
         if self.client and not self.client.is_closed:
             await self.client.aclose()
             log.info("Key Manager client session closed.")
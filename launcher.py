@@ -1,9 +1,14 @@
 # launcher.py
+import contextlib
 import subprocess
 import sys
 import os
+import select
+import socket
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 
 # Configure basic logging for the launcher
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,28 +28,91 @@ pqc_server_script = os.path.join(BASE_DIR, 'pqc_key_server.py')
 qumail_client_script = os.path.join(BASE_DIR, 'qumail_client.py')
 # Path to the Signaling Server script
 signaling_server_script = os.path.join(BASE_DIR, 'signaling_server.py')
+# Server logs live with the rest of the user's QuMail data; the working directory may be read-only
+LOG_DIR = os.path.join(os.path.expanduser("~"), ".qumail")
+
+PQC_SERVER_ADDRESS = ("127.0.0.1", 8001)
+SIGNALING_HEALTH_URL = "http://127.0.0.1:8081/health"
+# Upper bound on how long we wait for a freshly spawned server to come up
+READY_TIMEOUT = 15
 
 server_process = None
 signaling_process = None
 
+# Shared Popen options for the background servers. stdin is a fixed devnull rather than
+# an inherited console handle. On Windows, close_fds=False skips building the per-spawn
+# handle list; CREATE_NO_WINDOW hides the console window and is ignored elsewhere.
+_SPAWN_KWARGS = dict(
+    stdin=subprocess.DEVNULL,
+    stderr=subprocess.STDOUT,
+    close_fds=(sys.platform != "win32"),
+    creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
+    start_new_session=True, # Important to make it an independent process group
+)
+
+@contextlib.contextmanager
+def _open_server_log(filename):
+    """Opens an unbuffered append-only log file in LOG_DIR for a child server's stdout/stderr.
+
+    Falls back to DEVNULL if the file cannot be opened, so logging never blocks startup.
+    """
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        server_log = open(os.path.join(LOG_DIR, filename), 'ab', buffering=0)
+    except OSError as e:
+        log.warning(f"Could not open server log {filename} ({e}); discarding its output.")
+        yield subprocess.DEVNULL
+        return
+    with server_log:
+        yield server_log
+
+def _wait_port(address, overall_timeout=READY_TIMEOUT, interval=0.1):
+    """Polls until something accepts TCP connections on address. Returns True once it does."""
+    deadline = time.monotonic() + overall_timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(address, timeout=0.2):
+                return True
+        except OSError:
+            time.sleep(interval)
+    return False
+
+def _wait_ready(url, overall_timeout=READY_TIMEOUT, interval=0.1):
+    """Polls url until it answers 200. Returns True as soon as it does."""
+    deadline = time.monotonic() + overall_timeout
+    parsed = httpx.URL(url)
+    # Don't send HTTP at a server that isn't even listening yet
+    if not _wait_port((parsed.host, parsed.port), overall_timeout, interval):
+        return False
+
+    method = "HEAD" # No body to transfer or parse
+    with httpx.Client(timeout=0.5) as client:
+        while time.monotonic() < deadline:
+            try:
+                status = client.request(method, url).status_code
+                if status == 200:
+                    return True
+                if status == 405 and method == "HEAD":
+                    method = "GET" # Route only registered for GET
+                    continue
+            except httpx.HTTPError:
+                pass
+            time.sleep(interval)
+    return False
+
 def start_server():
     """Starts the PQC Key Server in the background without a console window."""
     global server_process
     log.info("Attempting to start PQC Key Server...")
     try:
-        # Use CREATE_NO_WINDOW to hide the console window on Windows
-        # For non-Windows OS, this flag is ignored.
-        # We also redirect stdout/stderr to PIPE to prevent them from showing up.
-        server_process = subprocess.Popen(
-            [sys.executable, pqc_server_script],
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            start_new_session=True # Important to make it an independent process group
-        )
+        # Output goes straight to a log file; an unread PIPE would eventually fill and block the server.
+        with _open_server_log("pqc_server.log") as server_log:
+            server_process = subprocess.Popen(
+                [sys.executable, pqc_server_script],
+                stdout=server_log,
+                **_SPAWN_KWARGS
+            )
         log.info(f"PQC Key Server started with PID: {server_process.pid}")
-        # Give the server a moment to start up
-        time.sleep(2)
     except FileNotFoundError:
         log.error(f"Error: {pqc_server_script} not found. Ensure it's in the bundle.")
         sys.exit(1)
@@ -57,31 +125,14 @@ def start_signaling_server():
     global signaling_process
     log.info("Attempting to start Signaling Server...")
     try:
-        # Use CREATE_NO_WINDOW to hide the console window on Windows
-        # For non-Windows OS, this flag is ignored.
-        # We also redirect stdout/stderr to PIPE to prevent them from showing up.
-        signaling_process = subprocess.Popen(
-            [sys.executable, signaling_server_script],
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            start_new_session=True # Important to make it an independent process group
-        )
+        # Output goes straight to a log file; an unread PIPE would eventually fill and block the server.
+        with _open_server_log("signaling_server.log") as server_log:
+            signaling_process = subprocess.Popen(
+                [sys.executable, signaling_server_script],
+                stdout=server_log,
+                **_SPAWN_KWARGS
+            )
         log.info(f"Signaling Server started with PID: {signaling_process.pid}")
-        # Give the server more time to start up
-        time.sleep(5)
-        
-        # Test if server is responding
-        try:
-            import httpx
-            response = httpx.get("http://127.0.0.1:8081/health", timeout=5.0)
-            if response.status_code == 200:
-                log.info("Signaling Server is responding correctly")
-            else:
-                log.warning(f"Signaling Server health check failed: {response.status_code}")
-        except Exception as e:
-            log.warning(f"Could not verify Signaling Server health: {e}")
-            
     except FileNotFoundError:
         log.error(f"Error: {signaling_server_script} not found. Ensure it's in the bundle.")
         sys.exit(1)
@@ -89,6 +140,55 @@ def start_signaling_server():
         log.error(f"Failed to start Signaling Server: {e}", exc_info=True)
         sys.exit(1)
 
+def _wait_exit(proc, timeout):
+    """Blocks until proc exits or timeout seconds pass. Returns True if it exited.
+
+    Uses a pidfd (Linux 5.3+) or kqueue (macOS/BSD) so the kernel wakes us on
+    exit, instead of Popen.wait()'s sleep-and-poll loop.
+    """
+    try:
+        if hasattr(os, 'pidfd_open'):
+            fd = os.pidfd_open(proc.pid)
+            try:
+                poller = select.poll()
+                poller.register(fd, select.POLLIN)
+                poller.poll(timeout * 1000)
+            finally:
+                os.close(fd)
+        elif hasattr(select, 'kqueue'):
+            kq = select.kqueue()
+            try:
+                event = select.kevent(proc.pid, filter=select.KQ_FILTER_PROC,
+                                      flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                                      fflags=select.KQ_NOTE_EXIT)
+                kq.control([event], 1, timeout)
+            finally:
+                kq.close()
+        else:
+            proc.wait(timeout=timeout)
+    except ProcessLookupError:
+        pass # Already exited
+    except subprocess.TimeoutExpired:
+        return False
+    except OSError:
+        # pidfd/kqueue unavailable at runtime (old kernel, sandbox); fall back to polling
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False
+    # Reap the child so it does not linger as a zombie
+    return proc.poll() is not None
+
+def wait_all_ready(checks):
+    """Runs every server's readiness probe in parallel. checks is a list of (name, probe, target)."""
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        futures = [(name, executor.submit(probe, target)) for name, probe, target in checks]
+        for name, future in futures:
+            if future.result():
+                log.info(f"{name} is ready")
+            else:
+                log.warning(f"{name} did not become ready within {READY_TIMEOUT} seconds")
+
 def start_client():
     """Starts the QuMail Client application."""
     log.info("Attempting to start QuMail Client...")
@@ -108,47 +208,43 @@ def start_client():
         log.error(f"Failed to start QuMail Client: {e}", exc_info=True)
         sys.exit(1)
 
+def _stop_server(name, proc):
+    """Waits for a terminated server to exit, killing it if it does not."""
+    try:
+        if _wait_exit(proc, 5): # Give it some time to terminate
+            log.info(f"{name} terminated successfully.")
+            return
+        log.warning(f"{name} did not terminate gracefully, killing it.")
+        proc.kill()
+        _wait_exit(proc, 1)
+    except Exception as e:
+        log.error(f"Error during {name} cleanup: {e}", exc_info=True)
+
 def cleanup_server():
-    """Attempts to terminate the server process when the client exits."""
-    global server_process, signaling_process
-    
-    # Cleanup PQC Key Server
-    if server_process and server_process.poll() is None: # If server is still running
-        log.info(f"Terminating PQC Key Server (PID: {server_process.pid})...")
-        server_process.terminate()
-        try:
-            server_process.wait(timeout=5) # Give it some time to terminate
-            log.info("PQC Key Server terminated successfully.")
-        except subprocess.TimeoutExpired:
-            log.warning("PQC Key Server did not terminate gracefully, killing it.")
-            server_process.kill()
-        except Exception as e:
-            log.error(f"Error during PQC server cleanup: {e}", exc_info=True)
-    else:
-        log.info("PQC Key Server was already stopped or not started.")
-    
-    # Cleanup Signaling Server
-    if signaling_process and signaling_process.poll() is None: # If signaling server is still running
-        log.info(f"Terminating Signaling Server (PID: {signaling_process.pid})...")
-        signaling_process.terminate()
-        try:
-            signaling_process.wait(timeout=5) # Give it some time to terminate
-            log.info("Signaling Server terminated successfully.")
-        except subprocess.TimeoutExpired:
-            log.warning("Signaling Server did not terminate gracefully, killing it.")
-            signaling_process.kill()
-        except Exception as e:
-            log.error(f"Error during signaling server cleanup: {e}", exc_info=True)
-    else:
-        log.info("Signaling Server was already stopped or not started.")
+    """Attempts to terminate the server processes when the client exits."""
+    stopping = []
+    for name, proc in (("PQC Key Server", server_process), ("Signaling Server", signaling_process)):
+        if proc and proc.poll() is None: # If server is still running
+            log.info(f"Terminating {name} (PID: {proc.pid})...")
+            proc.terminate()
+            stopping.append((name, proc))
+        else:
+            log.info(f"{name} was already stopped or not started.")
+
+    # Both servers were signalled above; wait for them together rather than one after the other
+    if stopping:
+        with ThreadPoolExecutor(max_workers=len(stopping)) as executor:
+            list(executor.map(lambda server: _stop_server(*server), stopping))
 
 if __name__ == "__main__":
     try:
+        # The servers do not depend on each other, so spawn both before waiting on either
         start_server()
         start_signaling_server()
-        
-        # Wait a bit more to ensure signaling server is ready
-        time.sleep(3)
+        wait_all_ready([
+            ("PQC Key Server", _wait_port, PQC_SERVER_ADDRESS),
+            ("Signaling Server", _wait_ready, SIGNALING_HEALTH_URL),
+        ])
         
         start_client() # This will block until the client GUI is closed
     finally:
@@ -1,8 +1,11 @@
 # main_window.py
 import logging
 import asyncio
+import functools
+import json
 import os
 import html
+from email.utils import parseaddr
 from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QGridLayout, QListWidget, QTableWidget,
     QToolBar, QTableWidgetItem, QAbstractItemView,
@@ -10,23 +13,93 @@ from PyQt6.QtWidgets import (
     QApplication, QVBoxLayout
 )
 from PyQt6.QtWebEngineWidgets import QWebEngineView
+from PyQt6.QtWebEngineCore import QWebEngineScript
 from PyQt6.QtGui import QAction, QCursor, QColor
-from PyQt6.QtCore import pyqtSlot, Qt, QUrl
+from PyQt6.QtCore import pyqtSlot, pyqtSignal, Qt, QUrl, QObject, QRunnable, QThreadPool, QTimer
 from compose_dialog import ComposeDialog
 from settings_dialog import SettingsDialog
 from call_dialog import CallDialog, IncomingCallDialog
 from call_controller import CallController
 from webrtc_service import CallType
+from email_services import EmailServiceError
 import qtawesome as qta
 import html_templates
 
 log = logging.getLogger(__name__)
 
+# Upper bound on how long closing the window waits for controllers to shut down
+SHUTDOWN_TIMEOUT = 5.0
+
+# Resolved once: each Qt enum access is a chain of attribute lookups through the sip bindings
+_USER_ROLE = Qt.ItemDataRole.UserRole
+
+# Scroll events arrive in bursts; wait this long after reaching the bottom before paging
+LOAD_MORE_DEBOUNCE_MS = 50
+
+# Dark-mode overrides for email bodies, matched natively by the browser instead of walking the DOM per load
+_DARK_MODE_CSS = """
+html, body { background-color: #3c3f41 !important; color: #dcdcdc !important; }
+[bgcolor="#ffffff" i], [bgcolor="#fff" i], [bgcolor="white" i],
+[style*="background-color: #fff" i], [style*="background-color:#fff" i],
+[style*="background-color: white" i], [style*="background-color:white" i],
+[style*="background-color: rgb(255, 255, 255)"] { background-color: #3c3f41 !important; }
+font[color="#000000" i], font[color="#000" i], font[color="black" i] { color: #dcdcdc !important; }
+"""
+_DARK_MODE_JS = f"""
+(function() {{
+    var style = document.createElement('style');
+    style.textContent = {json.dumps(_DARK_MODE_CSS)};
+    (document.head || document.documentElement).appendChild(style);
+}})();
+"""
+
+# Wrapper for plain-text bodies, split around the escaped text so rendering is a single join
+_PLAIN_PREFIX = "<html><body style='background-color:#3c3f41;color:#dcdcdc;font-family:monospace;white-space:pre-wrap;'>"
+_PLAIN_SUFFIX = "</body></html>"
+
+@functools.lru_cache(maxsize=128)
+def _icon(name, color='#dcdcdc'):
+    """qtawesome icons are costly to render; build each (name, color) once and share it."""
+    return qta.icon(name, color=color) if color else qta.icon(name)
+
+class AttachmentSaverSignals(QObject):
+    saved = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+class AttachmentSaver(QRunnable):
+    """Writes attachment bytes to disk on the thread pool in 1 MiB slices, without copying the buffer."""
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, content, path):
+        super().__init__()
+        self.content, self.path = content, path
+        self.signals = AttachmentSaverSignals()
+
+    def run(self):
+        try:
+            view = memoryview(self.content)
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o600)
+            try:
+                for start in range(0, len(view), self.CHUNK_SIZE):
+                    chunk = view[start:start + self.CHUNK_SIZE]
+                    while chunk:
+                        chunk = chunk[os.write(fd, chunk):]
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.saved.emit(self.path)
+
 class MainWindow(QMainWindow):
     def __init__(self, controller):
         super().__init__()
         self.controller = controller
         self.is_loading_more = False
+        self._load_timer = QTimer(self)
+        self._load_timer.setSingleShot(True)
+        self._load_timer.timeout.connect(self._maybe_load_more)
         self.setWindowTitle("QuMail")
         self.setGeometry(100, 100, 1280, 800)
         self.folder_icons = {
@@ -38,6 +111,11 @@ class MainWindow(QMainWindow):
         
         # Initialize call controller
         self.call_controller = None
+        self._current_attachments = []
+        # What the content view and attachment list currently show, so repeated updates can be skipped
+        self._shown_content = (None, None)
+        self._shown_attachments = ()
+        self._folder_index: dict[str, QListWidgetItem] = {}
         self.init_ui()
 
     def init_ui(self):
@@ -57,12 +135,12 @@ class MainWindow(QMainWindow):
         self.email_list_widget.setColumnWidth(2, 180)
         self.email_list_widget.setSortingEnabled(False)
         grid_layout.addWidget(self.email_list_widget, 0, 1)
-        self.email_content_browser = QWebEngineView()
-        self.email_content_browser.setContextMenuPolicy(Qt.ContextMenuPolicy.NoContextMenu)
-        self.email_content_browser.page().setBackgroundColor(QColor("#3c3f41"))
-        self.email_content_browser.setHtml(html_templates.EMPTY_VIEW_TEMPLATE)
-        grid_layout.addWidget(self.email_content_browser, 1, 1)
-        self.email_content_browser.loadFinished.connect(self.on_web_view_load_finished)
+        # QWebEngineView starts a Chromium process; show a blank placeholder until there is an email to render
+        self.email_content_browser = None
+        self.email_content_placeholder = QLabel()
+        self.email_content_placeholder.setStyleSheet("background-color: #3c3f41;")
+        grid_layout.addWidget(self.email_content_placeholder, 1, 1)
+        self._grid_layout = grid_layout
         self.attachment_container = QWidget()
         attachment_layout = QVBoxLayout(self.attachment_container)
         attachment_layout.setContentsMargins(0, 5, 0, 5)
@@ -81,14 +159,14 @@ class MainWindow(QMainWindow):
         grid_layout.setRowStretch(2, 0)
         toolbar = QToolBar("Main Toolbar")
         self.addToolBar(toolbar)
-        self.refresh_button = QAction(qta.icon('fa5s.sync-alt', color='#dcdcdc'), "Refresh", self)
-        self.compose_button = QAction(qta.icon('fa5s.pencil-alt', color='#dcdcdc'), "Compose", self)
-        self.reply_button = QAction(qta.icon('fa5s.reply', color='#dcdcdc'), "Reply", self)
-        self.reply_all_button = QAction(qta.icon('fa5s.reply-all', color='#dcdcdc'), "Reply All", self)
-        self.forward_button = QAction(qta.icon('fa5s.share', color='#dcdcdc'), "Forward", self)
-        self.voice_call_button = QAction(qta.icon('fa5s.phone', color='#dcdcdc'), "Voice Call", self)
-        self.video_call_button = QAction(qta.icon('fa5s.video', color='#dcdcdc'), "Video Call", self)
-        self.settings_button = QAction(qta.icon('fa5s.cog', color='#dcdcdc'), "Settings", self)
+        self.refresh_button = QAction(_icon('fa5s.sync-alt'), "Refresh", self)
+        self.compose_button = QAction(_icon('fa5s.pencil-alt'), "Compose", self)
+        self.reply_button = QAction(_icon('fa5s.reply'), "Reply", self)
+        self.reply_all_button = QAction(_icon('fa5s.reply-all'), "Reply All", self)
+        self.forward_button = QAction(_icon('fa5s.share'), "Forward", self)
+        self.voice_call_button = QAction(_icon('fa5s.phone'), "Voice Call", self)
+        self.video_call_button = QAction(_icon('fa5s.video'), "Video Call", self)
+        self.settings_button = QAction(_icon('fa5s.cog'), "Settings", self)
         toolbar.addAction(self.refresh_button)
         toolbar.addAction(self.compose_button)
         toolbar.addAction(self.reply_button)
@@ -122,24 +200,28 @@ class MainWindow(QMainWindow):
         self.voice_call_button.setEnabled(enabled)
         self.video_call_button.setEnabled(enabled)
 
-    @pyqtSlot(bool)
-    def on_web_view_load_finished(self, ok):
-        if not ok: return
-        js_code = """
-        document.body.style.backgroundColor = '#3c3f41';
-        var allElements = document.getElementsByTagName('*');
-        for (var i = 0, len = allElements.length; i < len; i++) {
-            var element = allElements[i];
-            var style = getComputedStyle(element);
-            if (style.getPropertyValue('background-color') === 'rgb(255, 255, 255)') {
-                element.style.backgroundColor = '#3c3f41';
-            }
-             if (style.getPropertyValue('color') === 'rgb(0, 0, 0)') {
-                element.style.color = '#dcdcdc';
-            }
-        }
-        """
-        self.email_content_browser.page().runJavaScript(js_code)
+    def _ensure_webview(self):
+        """Creates the email web view on first use, swapping it in for the placeholder."""
+        if self.email_content_browser is None:
+            view = QWebEngineView()
+            view.setContextMenuPolicy(Qt.ContextMenuPolicy.NoContextMenu)
+            view.page().setBackgroundColor(QColor("#3c3f41"))
+            self.install_dark_mode_script(view)
+            self._grid_layout.replaceWidget(self.email_content_placeholder, view)
+            self.email_content_placeholder.deleteLater()
+            self.email_content_placeholder = None
+            self.email_content_browser = view
+        return self.email_content_browser
+
+    @staticmethod
+    def install_dark_mode_script(web_view):
+        """Registers the dark-mode stylesheet once; the page injects it into every document it loads."""
+        script = QWebEngineScript()
+        script.setName("qumail-dark-mode")
+        script.setSourceCode(_DARK_MODE_JS)
+        script.setInjectionPoint(QWebEngineScript.InjectionPoint.DocumentReady)
+        script.setWorldId(QWebEngineScript.ScriptWorldId.MainWorld)
+        web_view.page().scripts().insert(script)
     
     def set_busy_state(self):
         self.is_loading_more = True
@@ -154,25 +236,35 @@ class MainWindow(QMainWindow):
         self.unsetCursor()
 
     def populate_folder_list(self, folders_with_original_names):
-        self.folder_list_widget.blockSignals(True)
-        self.folder_list_widget.clear()
+        folder_list = self.folder_list_widget
+        items = []
+        self._folder_index.clear()
         for clean_name, original_name in folders_with_original_names:
-            icon = qta.icon(self.folder_icons.get(clean_name, self.default_folder_icon), color='#dcdcdc')
+            icon = _icon(self.folder_icons.get(clean_name, self.default_folder_icon))
             item = QListWidgetItem(icon, clean_name)
-            item.setData(Qt.ItemDataRole.UserRole, original_name)
-            self.folder_list_widget.addItem(item)
-        self.folder_list_widget.blockSignals(False)
+            item.setData(_USER_ROLE, original_name)
+            items.append(item)
+            self._folder_index.setdefault(clean_name, item)
+
+        # Insert with repaints and signals off so the list lays out once rather than per folder
+        folder_list.setUpdatesEnabled(False)
+        folder_list.blockSignals(True)
+        try:
+            folder_list.clear()
+            for item in items:
+                folder_list.insertItem(folder_list.count(), item)
+        finally:
+            folder_list.blockSignals(False)
+            folder_list.setUpdatesEnabled(True)
+            folder_list.viewport().update()
 
     def find_folder_item(self, clean_name_to_find):
-        for i in range(self.folder_list_widget.count()):
-            if (item := self.folder_list_widget.item(i)).text() == clean_name_to_find:
-                return item
-        return None
+        return self._folder_index.get(clean_name_to_find)
 
     @pyqtSlot(QListWidgetItem)
     def on_folder_selected(self, current_item):
         if current_item:
-            original_folder_name = current_item.data(Qt.ItemDataRole.UserRole)
+            original_folder_name = current_item.data(_USER_ROLE)
             self.clear_email_list()
             self.display_email_content({})
             self.controller.start_folder_selection(original_folder_name)
@@ -185,35 +277,51 @@ class MainWindow(QMainWindow):
 
         html_content, plain_content = content_dict.get('html_body'), content_dict.get('plain_body')
         attachments = content_dict.get('attachments', [])
+        self.display_attachments(attachments)
+        # Every load is a full Chromium navigation; skip it when the view already shows this content
+        if (html_content, plain_content) == self._shown_content:
+            return
+        self._shown_content = (html_content, plain_content)
         if not html_content and not plain_content:
-            self.email_content_browser.setHtml(html_templates.EMPTY_VIEW_TEMPLATE)
+            if self.email_content_browser:
+                self.email_content_browser.setContent(html_templates.EMPTY_VIEW_BYTES, "text/html;charset=UTF-8")
         elif html_content:
             # Load HTML without forcing a file:// base URL so remote images resolve correctly
-            self.email_content_browser.setHtml(html_content)
+            self._ensure_webview().setHtml(html_content)
         elif plain_content:
-            escaped = html.escape(plain_content)
-            html_from_plain = f"<html><body style='background-color:#3c3f41;color:#dcdcdc;font-family:monospace;white-space:pre-wrap;'>{escaped}</body></html>"
-            self.email_content_browser.setHtml(html_from_plain)
-        self.display_attachments(attachments)
+            if isinstance(plain_content, bytes):
+                plain_content = plain_content.decode('utf-8', errors='replace')
+            html_from_plain = "".join((_PLAIN_PREFIX, html.escape(plain_content, quote=False), _PLAIN_SUFFIX))
+            # setContent takes the UTF-8 bytes directly rather than going through a QString conversion
+            self._ensure_webview().setContent(html_from_plain.encode('utf-8'), "text/html;charset=UTF-8")
 
     def display_attachments(self, attachments):
         # --- ADDED: Defensive Check ---
         if not isinstance(attachments, list):
             log.error(f"CRITICAL RENDER BUG: Received attachments of type {type(attachments)}, expected a list. Aborting display.")
+            self._shown_attachments = None
             self.attachment_container.setVisible(False)
             # --- ADDED: Force Repaint ---
             self.attachment_container.layout().activate()
             self.attachment_container.adjustSize()
             return
 
+        # Attachments may be deferred (content None + IMAP 'location'), so items keep an index, not the bytes.
+        self._current_attachments = attachments
+        # Items only show filenames, so an identical list needs no rebuild
+        shown = tuple(att['filename'] for att in attachments)
+        if shown == self._shown_attachments:
+            return
+        self._shown_attachments = shown
         self.attachment_list_widget.clear()
         if attachments:
             # --- ADDED: Forensic Logging ---
             log.info(f"Displaying {len(attachments)} attachments: {[att['filename'] for att in attachments]}")
             self.attachment_container.setVisible(True)
-            for att in attachments:
-                item = QListWidgetItem(qta.icon('fa5s.file-download'), att['filename'])
-                item.setData(Qt.ItemDataRole.UserRole, att['content'])
+            download_icon = _icon('fa5s.file-download', color=None)
+            for i, att in enumerate(attachments):
+                item = QListWidgetItem(download_icon, att['filename'])
+                item.setData(_USER_ROLE, i)
                 self.attachment_list_widget.addItem(item)
         else:
             self.attachment_container.setVisible(False)
@@ -228,20 +336,37 @@ class MainWindow(QMainWindow):
         self.email_list_widget.setRowCount(0)
 
     def append_emails_to_list(self, headers):
-        self.email_list_widget.setSortingEnabled(False)
-        start_row = self.email_list_widget.rowCount()
-        for i, header in enumerate(headers):
-            row, from_item, subject_item, date_item = start_row + i, QTableWidgetItem(header.get('from')), QTableWidgetItem(header.get('subject')), QTableWidgetItem(header.get('date'))
-            self.email_list_widget.insertRow(row)
-            if uid := header.get('uid'): from_item.setData(Qt.ItemDataRole.UserRole, uid)
-            self.email_list_widget.setItem(row, 0, from_item)
-            self.email_list_widget.setItem(row, 1, subject_item)
-            self.email_list_widget.setItem(row, 2, date_item)
+        table = self.email_list_widget
+        table.setSortingEnabled(False)
+        start_row = table.rowCount()
+        # Size the grid once and fill it with signals and repaints off, instead of a relayout per insertRow
+        table.setUpdatesEnabled(False)
+        table.blockSignals(True)
+        try:
+            table.setRowCount(start_row + len(headers))
+            set_item, item_cls, user_role = table.setItem, QTableWidgetItem, _USER_ROLE
+            for row, header in enumerate(headers, start_row):
+                from_item = item_cls(header.get('from'))
+                if uid := header.get('uid'): from_item.setData(user_role, uid)
+                set_item(row, 0, from_item)
+                set_item(row, 1, item_cls(header.get('subject')))
+                set_item(row, 2, item_cls(header.get('date')))
+        finally:
+            table.blockSignals(False)
+            table.setUpdatesEnabled(True)
+            table.viewport().update()
 
     @pyqtSlot(int)
     def on_scroll(self, value):
-        scrollbar = self.email_list_widget.verticalScrollBar()
-        if value >= scrollbar.maximum() * 0.9 and not self.is_loading_more:
+        if not self.is_loading_more and not self._load_timer.isActive() and self._near_list_bottom(value):
+            self._load_timer.start(LOAD_MORE_DEBOUNCE_MS)
+
+    def _near_list_bottom(self, value):
+        return value >= self.email_list_widget.verticalScrollBar().maximum() * 0.9
+
+    @pyqtSlot()
+    def _maybe_load_more(self):
+        if not self.is_loading_more and self._near_list_bottom(self.email_list_widget.verticalScrollBar().value()):
             asyncio.create_task(self.controller.load_next_page_of_emails())
 
     @pyqtSlot()
@@ -249,7 +374,7 @@ class MainWindow(QMainWindow):
         selected_items = self.email_list_widget.selectedItems()
         if not selected_items: return
         uid_item = self.email_list_widget.item(selected_items[0].row(), 0)
-        if uid_item and (uid := uid_item.data(Qt.ItemDataRole.UserRole)):
+        if uid_item and (uid := uid_item.data(_USER_ROLE)):
             self.controller.start_email_selection(uid)
     
     def open_compose_dialog(self, to_addr="", subject="", body=""):
@@ -265,17 +390,41 @@ class MainWindow(QMainWindow):
 
     @pyqtSlot(QListWidgetItem)
     def on_attachment_clicked(self, item):
-        filename, content = item.text(), item.data(Qt.ItemDataRole.UserRole)
-        save_path, _ = QFileDialog.getSaveFileName(self, "Save Attachment", os.path.join(os.path.expanduser("~/Downloads"), filename))
+        att = self._current_attachments[item.data(_USER_ROLE)]
+        save_path, _ = QFileDialog.getSaveFileName(self, "Save Attachment", os.path.join(os.path.expanduser("~/Downloads"), att['filename']))
         if save_path:
-            try:
-                with open(save_path, 'wb') as f: f.write(content)
-            except IOError as e: self.show_error_message("Save Failed", f"Could not save file:\n{e}")
+            asyncio.create_task(self.save_attachment(att, save_path))
+
+    async def save_attachment(self, att, save_path):
+        try:
+            if att.get('content') is None:
+                self.update_status_bar(f"Downloading {att['filename']}...")
+                att['content'] = await self.controller.fetch_attachment(att)
+        except EmailServiceError as e:
+            self.show_error_message("Download Failed", f"Could not download attachment:\n{e}")
+            return
+
+        saver = AttachmentSaver(att['content'], save_path)
+        # Bound slots (not lambdas) so Qt queues the callbacks back onto the GUI thread
+        saver.signals.saved.connect(self.on_attachment_saved)
+        saver.signals.failed.connect(self.on_attachment_save_failed)
+        self.setCursor(QCursor(Qt.CursorShape.WaitCursor))
+        QThreadPool.globalInstance().start(saver)
+
+    @pyqtSlot(str)
+    def on_attachment_saved(self, save_path):
+        self.unsetCursor()
+        self.update_status_bar(f"Saved {os.path.basename(save_path)}.")
+
+    @pyqtSlot(str)
+    def on_attachment_save_failed(self, error):
+        self.unsetCursor()
+        self.show_error_message("Save Failed", f"Could not save file:\n{error}")
 
     def initialize_call_controller(self, current_user: str):
         """Initialize the call controller"""
         if not self.call_controller:
-            self.call_controller = CallController(current_user)
+            self.call_controller = CallController(current_user, settings_manager=self.controller.settings_manager)
             log.info("Call controller initialized")
             
             # Test audio functionality after initialization
@@ -284,14 +433,19 @@ class MainWindow(QMainWindow):
     async def test_audio_after_init(self):
         """Test audio functionality after call controller initialization"""
         try:
-            # Wait a bit for initialization to complete
-            await asyncio.sleep(2)
+            # Wake up as soon as initialization completes instead of guessing with a fixed sleep
+            await asyncio.wait_for(self.call_controller.ready_event.wait(), timeout=10.0)
             
             if self.call_controller:
                 await self.call_controller.test_audio_functionality()
         except Exception as e:
             log.error(f"Failed to test audio after initialization: {e}")
     
+    def _sender_address(self) -> str:
+        """Address part of the current email's From header, or '' if there is none."""
+        _, address = parseaddr(str(self.controller.current_email_object['raw_message'].get('From', '')))
+        return address
+
     def initiate_voice_call(self):
         """Initiate a voice call with the current email sender"""
         if not self.controller.current_email_object:
@@ -307,9 +461,8 @@ class MainWindow(QMainWindow):
             return
 
         # Get sender email from current email
-        msg = self.controller.current_email_object['raw_message']
-        sender_email = msg.get('From', '').split('<')[-1].split('>')[0].strip()
-        if not sender_email or '@' not in sender_email:
+        sender_email = self._sender_address()
+        if '@' not in sender_email:
             self.show_error_message("Invalid Sender", "Could not determine sender email address.")
             return
 
@@ -335,9 +488,8 @@ class MainWindow(QMainWindow):
             return
         
         # Get sender email from current email
-        msg = self.controller.current_email_object['raw_message']
-        sender_email = msg.get('From', '').split('<')[-1].split('>')[0].strip()
-        if not sender_email or '@' not in sender_email:
+        sender_email = self._sender_address()
+        if '@' not in sender_email:
             self.show_error_message("Invalid Sender", "Could not determine sender email address.")
             return
         
@@ -351,11 +503,17 @@ class MainWindow(QMainWindow):
     def closeEvent(self, event):
         self.setEnabled(False)
         async def close_sequence():
-            try: 
-                # Shutdown call controller
-                if self.call_controller:
-                    await self.call_controller.shutdown()
-                await self.controller.shutdown()
+            # The call and email controllers tear down independently, so shut them down together
+            shutdowns = [self.controller.shutdown(), self.controller.settings_manager.close()]
+            if self.call_controller:
+                shutdowns.append(self.call_controller.shutdown())
+            try:
+                results = await asyncio.wait_for(asyncio.gather(*shutdowns, return_exceptions=True), SHUTDOWN_TIMEOUT)
+                for result in results:
+                    if isinstance(result, Exception):
+                        log.error(f"Error during shutdown: {result}", exc_info=result)
+            except asyncio.TimeoutError:
+                log.warning(f"Shutdown did not finish within {SHUTDOWN_TIMEOUT} seconds, quitting anyway.")
             except Exception as e: log.error(f"Error during shutdown: {e}", exc_info=True)
             finally: QApplication.instance().quit()
         asyncio.create_task(close_sequence())
@@ -0,0 +1,48 @@
+# media_devices.py
+import functools
+import logging
+from PyQt6.QtMultimedia import QMediaDevices
+
+log = logging.getLogger(__name__)
+
+# Every QMediaDevices query probes the OS audio/video stack (WASAPI, PulseAudio, ...),
+# so results are kept until Qt reports that the device set has changed.
+_cache = {}
+_watcher = None
+
+def _watch():
+    """Creates the change watcher on first use, once a QApplication exists."""
+    global _watcher
+    if _watcher is None:
+        _watcher = QMediaDevices()
+        _watcher.audioInputsChanged.connect(functools.partial(_invalidate, 'audio_inputs', 'default_audio_input'))
+        _watcher.audioOutputsChanged.connect(functools.partial(_invalidate, 'audio_outputs', 'default_audio_output'))
+        _watcher.videoInputsChanged.connect(functools.partial(_invalidate, 'video_inputs'))
+
+def _invalidate(*keys):
+    log.debug("Media devices changed, dropping cached %s", ", ".join(keys))
+    for key in keys:
+        _cache.pop(key, None)
+
+def _cached(key, query):
+    _watch()
+    try:
+        return _cache[key]
+    except KeyError:
+        value = _cache[key] = query()
+        return value
+
+def audio_inputs():
+    return _cached('audio_inputs', QMediaDevices.audioInputs)
+
+def audio_outputs():
+    return _cached('audio_outputs', QMediaDevices.audioOutputs)
+
+def video_inputs():
+    return _cached('video_inputs', QMediaDevices.videoInputs)
+
+def default_audio_input():
+    return _cached('default_audio_input', QMediaDevices.defaultAudioInput)
+
+def default_audio_output():
+    return _cached('default_audio_output', QMediaDevices.defaultAudioOutput)
@@ -1,17 +1,91 @@
 # native_call_widget.py
+import functools
 import logging
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel
-from PyQt6.QtCore import QObject, pyqtSignal, QTimer, QThread, pyqtSlot, Qt
-from PyQt6.QtMultimedia import QMediaDevices, QAudioInput, QAudioOutput, QCamera, QMediaCaptureSession, QAudioSink, QAudioSource
+from PyQt6.QtCore import QObject, pyqtSignal, Qt
+from PyQt6.QtMultimedia import QAudioInput, QAudioOutput, QCamera, QMediaCaptureSession
 from PyQt6.QtMultimediaWidgets import QVideoWidget
-from PyQt6.QtCore import QIODevice, QByteArray
 import socket
-import json
-import asyncio
-import threading
+import media_devices
 
 log = logging.getLogger(__name__)
 
+_AVATAR_COLORS = ("#667eea", "#f093fb", "#4facfe", "#43e97b", "#fa709a")
+_AVATAR_STYLE = """
+    QLabel {
+        background-color: %s;
+        border: 3px solid #ffffff;
+        border-radius: %dpx;
+        color: white;
+        font-size: %dpx;
+        font-weight: bold;
+    }
+"""
+_NAME_LABEL_STYLE = """
+    QLabel {
+        color: #e2e8f0;
+        font-size: 14px;
+        font-weight: 500;
+        background-color: transparent;
+        margin-top: 8px;
+    }
+"""
+_PLACEHOLDER_STYLE = """
+    VideoPlaceholder {
+        background: qlineargradient(x1:0, y1:0, x2:1, y2:1, 
+            stop:0 #4a5568, stop:1 #2d3748);
+        border: 2px solid #4a5568;
+        border-radius: 12px;
+    }
+"""
+# Mute and video buttons share one style; both turn red while checked
+_TOGGLE_BUTTON_STYLE = """
+    QPushButton {
+        background-color: #4a5568;
+        border: none;
+        border-radius: 25px;
+        color: white;
+        font-size: 20px;
+    }
+    QPushButton:hover {
+        background-color: #5a6578;
+    }
+    QPushButton:checked {
+        background-color: #e53e3e;
+    }
+"""
+_END_BUTTON_STYLE = """
+    QPushButton {
+        background-color: #e53e3e;
+        border: none;
+        border-radius: 30px;
+        color: white;
+        font-size: 24px;
+    }
+    QPushButton:hover {
+        background-color: #c53030;
+    }
+"""
+_CALL_WIDGET_STYLE = """
+    NativeCallWidget {
+        background-color: #1a202c;
+    }
+"""
+
+@functools.lru_cache(maxsize=256)
+def _initials(user_name: str) -> str:
+    """Up to two initials from the first two words of a name, "U" when there are none."""
+    parts = user_name.split(None, 2)
+    if not parts:
+        return "U"
+    return (parts[0][:1] + (parts[1][:1] if len(parts) > 1 else "")).upper()
+
+@functools.lru_cache(maxsize=128)
+def _avatar_style(user_name: str, size: int) -> str:
+    """Avatar stylesheet for a user, built once per (name, size) instead of on every placeholder."""
+    color = _AVATAR_COLORS[hash(user_name) % len(_AVATAR_COLORS)]
+    return _AVATAR_STYLE % (color, size // 2, size // 3)
+
 class AudioStreamer(QObject):
     """Handle audio streaming for voice calls"""
     
@@ -28,12 +102,12 @@ class AudioStreamer(QObject):
         """Start audio streaming"""
         try:
             # Setup audio input (microphone)
-            audio_device = QMediaDevices.defaultAudioInput()
+            audio_device = media_devices.default_audio_input()
             if not audio_device.isNull():
                 self.audio_input = QAudioInput(audio_device)
                 
             # Setup audio output (speakers)
-            output_device = QMediaDevices.defaultAudioOutput()
+            output_device = media_devices.default_audio_output()
             if not output_device.isNull():
                 self.audio_output = QAudioOutput(output_device)
                 
@@ -51,8 +125,10 @@ class AudioStreamer(QObject):
     def stop_audio_stream(self):
         """Stop audio streaming"""
         self.is_streaming = False
+        # The streamer lives only as long as its call widget, so the socket goes with the call
         if self.remote_socket:
             self.remote_socket.close()
+            self.remote_socket = None
         log.info("Audio streaming stopped")
 
 class VideoStreamer(QObject):
@@ -68,7 +144,7 @@ class VideoStreamer(QObject):
         """Start video streaming"""
         try:
             # Get default camera
-            cameras = QMediaDevices.videoInputs()
+            cameras = media_devices.video_inputs()
             if cameras:
                 self.camera = QCamera(cameras[0])
                 self.capture_session = QMediaCaptureSession()
@@ -113,52 +189,23 @@ class VideoPlaceholder(QWidget):
         self.avatar_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         
         # Generate initials
-        initials = ''.join([word[0].upper() for word in user_name.split()[:2]])
-        if not initials:
-            initials = "U"
+        initials = _initials(user_name)
         
         # Color based on user
-        colors = ["#667eea", "#f093fb", "#4facfe", "#43e97b", "#fa709a"]
-        color = colors[hash(user_name) % len(colors)]
-        
-        self.avatar_label.setStyleSheet(f"""
-            QLabel {{
-                background-color: {color};
-                border: 3px solid #ffffff;
-                border-radius: {size//2}px;
-                color: white;
-                font-size: {size//3}px;
-                font-weight: bold;
-            }}
-        """)
+        self.avatar_label.setStyleSheet(_avatar_style(user_name, size))
         self.avatar_label.setText(initials)
         
         # Name label
         self.name_label = QLabel("You" if is_local else user_name)
         self.name_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.name_label.setStyleSheet("""
-            QLabel {
-                color: #e2e8f0;
-                font-size: 14px;
-                font-weight: 500;
-                background-color: transparent;
-                margin-top: 8px;
-            }
-        """)
+        self.name_label.setStyleSheet(_NAME_LABEL_STYLE)
         
         layout.addWidget(self.avatar_label)
         layout.addWidget(self.name_label)
         layout.setContentsMargins(10, 10, 10, 10)
         
         # Background styling
-        self.setStyleSheet("""
-            VideoPlaceholder {
-                background: qlineargradient(x1:0, y1:0, x2:1, y2:1, 
-                    stop:0 #4a5568, stop:1 #2d3748);
-                border: 2px solid #4a5568;
-                border-radius: 12px;
-            }
-        """)
+        self.setStyleSheet(_PLACEHOLDER_STYLE)
 
 class NativeCallWidget(QWidget):
     """Native Qt multimedia call widget"""
@@ -213,6 +260,12 @@ class NativeCallWidget(QWidget):
         self.remote_layout = QVBoxLayout(self.remote_container)
         self.remote_layout.setContentsMargins(0, 0, 0, 0)
         
+        # Video widgets stay resident in their containers; switching modes only flips visibility
+        self.local_video.setVisible(False)
+        self.remote_video.setVisible(False)
+        self.local_layout.addWidget(self.local_video)
+        self.remote_layout.addWidget(self.remote_video)
+        
         # Add to video layout
         self.video_layout.addWidget(self.local_container)
         self.video_layout.addWidget(self.remote_container, 1)
@@ -227,59 +280,20 @@ class NativeCallWidget(QWidget):
         self.mute_btn.setFixedSize(50, 50)
         self.mute_btn.setCheckable(True)
         self.mute_btn.clicked.connect(self.toggle_mute)
-        self.mute_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a5568;
-                border: none;
-                border-radius: 25px;
-                color: white;
-                font-size: 20px;
-            }
-            QPushButton:hover {
-                background-color: #5a6578;
-            }
-            QPushButton:checked {
-                background-color: #e53e3e;
-            }
-        """)
+        self.mute_btn.setStyleSheet(_TOGGLE_BUTTON_STYLE)
         self.mute_btn.setText("🎤")
         
         self.video_btn = QPushButton()
         self.video_btn.setFixedSize(50, 50)
         self.video_btn.setCheckable(True)
         self.video_btn.clicked.connect(self.toggle_video)
-        self.video_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a5568;
-                border: none;
-                border-radius: 25px;
-                color: white;
-                font-size: 20px;
-            }
-            QPushButton:hover {
-                background-color: #5a6578;
-            }
-            QPushButton:checked {
-                background-color: #e53e3e;
-            }
-        """)
+        self.video_btn.setStyleSheet(_TOGGLE_BUTTON_STYLE)
         self.video_btn.setText("📹")
         
         self.end_btn = QPushButton()
         self.end_btn.setFixedSize(60, 60)
         self.end_btn.clicked.connect(self.end_call)
-        self.end_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #e53e3e;
-                border: none;
-                border-radius: 30px;
-                color: white;
-                font-size: 24px;
-            }
-            QPushButton:hover {
-                background-color: #c53030;
-            }
-        """)
+        self.end_btn.setStyleSheet(_END_BUTTON_STYLE)
         self.end_btn.setText("📞")
         
         controls_layout.addStretch()
@@ -293,19 +307,15 @@ class NativeCallWidget(QWidget):
         self.setLayout(layout)
         
         # Set dark theme
-        self.setStyleSheet("""
-            NativeCallWidget {
-                background-color: #1a202c;
-            }
-        """)
+        self.setStyleSheet(_CALL_WIDGET_STYLE)
         
     def setup_multimedia(self):
         """Setup multimedia devices"""
         try:
             # Check available devices
-            audio_inputs = QMediaDevices.audioInputs()
-            audio_outputs = QMediaDevices.audioOutputs()
-            video_inputs = QMediaDevices.videoInputs()
+            audio_inputs = media_devices.audio_inputs()
+            audio_outputs = media_devices.audio_outputs()
+            video_inputs = media_devices.video_inputs()
             
             log.info(f"Found {len(audio_inputs)} audio input devices")
             log.info(f"Found {len(audio_outputs)} audio output devices")
@@ -363,42 +373,30 @@ class NativeCallWidget(QWidget):
     
     def show_video_widgets(self):
         """Show actual video widgets"""
-        # Clear placeholders
-        self.clear_containers()
-        
-        # Add video widgets
-        self.local_layout.addWidget(self.local_video)
-        self.remote_layout.addWidget(self.remote_video)
-        
-        self.local_video.show()
-        self.remote_video.show()
+        self._set_mode(video=True)
     
     def show_placeholder_widgets(self):
         """Show avatar placeholders"""
-        # Clear video widgets
-        self.clear_containers()
-        
-        # Create placeholders
-        self.local_placeholder = VideoPlaceholder("You", is_local=True)
-        self.remote_placeholder = VideoPlaceholder(self.remote_user, is_local=False)
-        
-        # Add placeholders
-        self.local_layout.addWidget(self.local_placeholder)
-        self.remote_layout.addWidget(self.remote_placeholder)
+        # Placeholders are created once and kept in the containers; only a new remote user needs a new one
+        if self.local_placeholder is None:
+            self.local_placeholder = VideoPlaceholder("You", is_local=True)
+            self.local_layout.addWidget(self.local_placeholder)
+        if self.remote_placeholder is None or self.remote_placeholder.user_name != self.remote_user:
+            if self.remote_placeholder is not None:
+                self.remote_layout.removeWidget(self.remote_placeholder)
+                self.remote_placeholder.deleteLater()
+            self.remote_placeholder = VideoPlaceholder(self.remote_user, is_local=False)
+            self.remote_layout.addWidget(self.remote_placeholder)
+        self._set_mode(video=False)
     
-    def clear_containers(self):
-        """Clear all widgets from containers"""
-        # Clear local container
-        while self.local_layout.count():
-            child = self.local_layout.takeAt(0)
-            if child.widget():
-                child.widget().setParent(None)
-        
-        # Clear remote container
-        while self.remote_layout.count():
-            child = self.remote_layout.takeAt(0)
-            if child.widget():
-                child.widget().setParent(None)
+    def _set_mode(self, video: bool):
+        """Shows either the video widgets or the placeholders without re-parenting anything"""
+        self.local_video.setVisible(video)
+        self.remote_video.setVisible(video)
+        if self.local_placeholder is not None:
+            self.local_placeholder.setVisible(not video)
+        if self.remote_placeholder is not None:
+            self.remote_placeholder.setVisible(not video)
     
     def end_call(self):
         """End the current call"""
@@ -1,20 +1,30 @@
 # native_webrtc_service.py
 import asyncio
+import functools
 import json
 import logging
 import uuid
+from collections import deque
 import socket
 import threading
 from typing import Optional, Dict, Any, Callable
 from dataclasses import dataclass
 from enum import Enum
 from PyQt6.QtCore import QObject, pyqtSignal, QTimer, QThread
-from PyQt6.QtNetwork import QUdpSocket, QHostAddress
-from PyQt6.QtMultimedia import QMediaDevices, QAudioInput, QAudioOutput
+from PyQt6.QtNetwork import QUdpSocket, QHostAddress, QAbstractSocket
+from PyQt6.QtMultimedia import QAudioInput, QAudioOutput
 import httpx
+import orjson
+import media_devices
 
 log = logging.getLogger(__name__)
 
+# Kernel receive buffer for media sockets, large enough to ride out a burst of late packets
+MEDIA_RECEIVE_BUFFER_SIZE = 262144
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# Size of the media port range starting at NativeWebRTCService.base_port
+MEDIA_PORT_COUNT = 64
+
 class CallType(Enum):
     VOICE = "voice"
     VIDEO = "video"
@@ -28,7 +38,8 @@ class CallState(Enum):
     ENDED = "ended"
     FAILED = "failed"
 
-@dataclass
+# Slotted: sessions are read on every state change and never grow extra attributes
+@dataclass(slots=True, eq=False)
 class CallSession:
     call_id: str
     call_type: CallType
@@ -40,14 +51,46 @@ class CallSession:
     start_time: Optional[float] = None
     end_time: Optional[float] = None
 
+class _SocketPool:
+    """Media UDP sockets, each bound to its port once and reused across calls.
+
+    Binding on every call start costs a socket allocation and a bind() on the
+    call-setup path, and closing on hangup throws the receive buffer away.
+    """
+
+    def __init__(self):
+        self._sockets: Dict[int, QUdpSocket] = {}
+
+    def acquire(self, port: int) -> QUdpSocket:
+        sock = self._sockets.get(port)
+        if sock is None or sock.state() != QAbstractSocket.SocketState.BoundState:
+            sock = QUdpSocket()
+            if not sock.bind(QHostAddress(QHostAddress.SpecialAddress.LocalHost), port,
+                             QUdpSocket.BindFlag.ReuseAddressHint):
+                raise OSError(f"Could not bind media port {port}: {sock.errorString()}")
+            sock.setSocketOption(QAbstractSocket.SocketOption.ReceiveBufferSizeSocketOption, MEDIA_RECEIVE_BUFFER_SIZE)
+            self._sockets[port] = sock
+        return sock
+
+    def release(self, sock: QUdpSocket):
+        # Keep the socket bound for the next call; just drop anything still queued from this one
+        while sock.hasPendingDatagrams():
+            sock.receiveDatagram()
+
+    def close(self):
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets.clear()
+
 class AudioHandler(QObject):
     """Handle audio streaming using Qt multimedia"""
     
-    def __init__(self):
+    def __init__(self, socket_pool: Optional[_SocketPool] = None):
         super().__init__()
         self.audio_input = None
         self.audio_output = None
-        self.udp_socket = QUdpSocket()
+        self.socket_pool = socket_pool or _SocketPool()
+        self.udp_socket = None
         self.is_streaming = False
         self.remote_address = None
         self.remote_port = None
@@ -55,18 +98,18 @@ class AudioHandler(QObject):
     def start_streaming(self, remote_host: str, remote_port: int, local_port: int):
         """Start audio streaming"""
         try:
-            # Setup UDP socket for audio
-            self.udp_socket.bind(QHostAddress.LocalHost, local_port)
+            # Setup UDP socket for audio; the pool hands back an already-bound socket for this port
+            self.udp_socket = self.socket_pool.acquire(local_port)
             self.remote_address = QHostAddress(remote_host)
             self.remote_port = remote_port
             
             # Setup audio input
-            audio_device = QMediaDevices.defaultAudioInput()
+            audio_device = media_devices.default_audio_input()
             if not audio_device.isNull():
                 self.audio_input = QAudioInput(audio_device)
                 
             # Setup audio output
-            output_device = QMediaDevices.defaultAudioOutput()
+            output_device = media_devices.default_audio_output()
             if not output_device.isNull():
                 self.audio_output = QAudioOutput(output_device)
             
@@ -82,7 +125,8 @@ class AudioHandler(QObject):
         """Stop audio streaming"""
         self.is_streaming = False
         if self.udp_socket:
-            self.udp_socket.close()
+            self.socket_pool.release(self.udp_socket)
+            self.udp_socket = None
         log.info("Audio streaming stopped")
 
 class NativeWebRTCService(QObject):
@@ -98,19 +142,36 @@ class NativeWebRTCService(QObject):
     def __init__(self, signaling_server_url: str = "http://127.0.0.1:8081"):
         super().__init__()
         self.signaling_server_url = signaling_server_url.rstrip('/')
-        self.client = httpx.AsyncClient(timeout=10.0)
+        self.client = self._create_http_client()
         self.active_calls: Dict[str, CallSession] = {}
         self.audio_handler = AudioHandler()
         self.is_initialized = False
         self.base_port = 8090  # Base port for media streaming
+        # Ports are handed out and returned explicitly so a call still tearing down never shares one
+        self._free_ports = deque(range(self.base_port, self.base_port + MEDIA_PORT_COUNT))
+        # Signaling sends run alongside media setup; kept here so close() can wait for them
+        self._pending_sig: set[asyncio.Task] = set()
         
+    @staticmethod
+    def _create_http_client() -> httpx.AsyncClient:
+        """One pooled client so call initiation, answer and end ride the same warm connection"""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(5.0, connect=2.0),
+            # A custom transport ignores the client's limits=, so the pool is configured here
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=1,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60.0),
+            ),
+        )
+
     async def initialize(self) -> bool:
         """Initialize the native WebRTC service"""
         try:
             # Check multimedia devices
-            audio_inputs = QMediaDevices.audioInputs()
-            audio_outputs = QMediaDevices.audioOutputs()
-            video_inputs = QMediaDevices.videoInputs()
+            audio_inputs = media_devices.audio_inputs()
+            audio_outputs = media_devices.audio_outputs()
+            video_inputs = media_devices.video_inputs()
             
             if not audio_inputs:
                 log.error("No audio input devices found")
@@ -124,9 +185,10 @@ class NativeWebRTCService(QObject):
             
             log.info(f"Found {len(audio_inputs)} audio inputs, {len(audio_outputs)} audio outputs, {len(video_inputs)} video inputs")
             
-            # Test signaling server connection
+            # Test signaling server connection; this also opens the pooled connection before the first call
             try:
-                response = await self.client.get(f"{self.signaling_server_url}/health", timeout=5.0)
+                response = await self.client.get(f"{self.signaling_server_url}/health")
+                log.debug("Signaling server answered over %s", response.http_version)
                 if response.status_code == 200:
                     self.is_initialized = True
                     log.info("Native WebRTC service initialized successfully")
@@ -154,7 +216,7 @@ class NativeWebRTCService(QObject):
             raise RuntimeError("Native WebRTC service not initialized")
         
         call_id = str(uuid.uuid4())
-        local_port = self.base_port + len(self.active_calls)
+        local_port = self._allocate_port()
         
         call_session = CallSession(
             call_id=call_id,
@@ -169,15 +231,15 @@ class NativeWebRTCService(QObject):
         self.call_state_changed.emit(call_id, CallState.INITIATING.value)
         
         try:
-            # Send call initiation to signaling server
-            await self._send_signaling_message({
+            # Send call initiation to signaling server while media starts locally
+            self._send_signaling_in_background({
                 "type": "call_initiation",
                 "call_id": call_id,
                 "call_type": call_type.value,
                 "from": local_user,
                 "to": remote_user,
                 "local_port": local_port
-            })
+            }, call_id)
             
             # Start media streaming
             if not self.audio_handler.start_streaming("127.0.0.1", local_port + 1, local_port):
@@ -191,6 +253,7 @@ class NativeWebRTCService(QObject):
             
         except Exception as e:
             log.error(f"Failed to initiate call: {e}")
+            self._release_port(call_session)
             call_session.state = CallState.FAILED
             self.call_state_changed.emit(call_id, CallState.FAILED.value)
             self.error_occurred.emit(f"Failed to initiate call: {e}")
@@ -207,12 +270,12 @@ class NativeWebRTCService(QObject):
         self.call_state_changed.emit(call_id, CallState.CONNECTING.value)
         
         try:
-            # Send answer to signaling server
-            await self._send_signaling_message({
+            # Send answer to signaling server while media starts locally
+            self._send_signaling_in_background({
                 "type": "call_answer",
                 "call_id": call_id,
                 "local_port": call_session.local_port
-            })
+            }, call_id)
             
             # Start media streaming
             if not self.audio_handler.start_streaming("127.0.0.1", call_session.remote_port or 8091, call_session.local_port):
@@ -243,8 +306,8 @@ class NativeWebRTCService(QObject):
         call_session.end_time = asyncio.get_event_loop().time()
         
         try:
-            # Send end call to signaling server
-            await self._send_signaling_message({
+            # Send end call to signaling server; local teardown does not wait for it
+            self._send_signaling_in_background({
                 "type": "call_end",
                 "call_id": call_id
             })
@@ -254,6 +317,7 @@ class NativeWebRTCService(QObject):
             
             # Remove from active calls
             del self.active_calls[call_id]
+            self._release_port(call_session)
             
             self.call_ended.emit(call_id)
             log.info(f"Call {call_id} ended")
@@ -264,6 +328,39 @@ class NativeWebRTCService(QObject):
             self.error_occurred.emit(f"Failed to end call: {e}")
             return False
     
+    def _send_signaling_in_background(self, message: Dict[str, Any], call_id: Optional[str] = None):
+        """Sends a signaling message without holding up the caller.
+
+        If the send fails, the call named by call_id (when it is still live) is marked failed.
+        """
+        task = asyncio.create_task(self._send_signaling_message(message))
+        self._pending_sig.add(task)
+        task.add_done_callback(functools.partial(self._on_signaling_sent, call_id))
+
+    def _on_signaling_sent(self, call_id: Optional[str], task: asyncio.Task):
+        self._pending_sig.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        call_session = self.active_calls.get(call_id) if call_id else None
+        if call_session and call_session.state not in (CallState.ENDED, CallState.FAILED):
+            call_session.state = CallState.FAILED
+            self.call_state_changed.emit(call_id, CallState.FAILED.value)
+        self.error_occurred.emit(f"Signaling failed: {error}")
+
+    def _allocate_port(self) -> int:
+        """Takes a media port off the free list"""
+        try:
+            return self._free_ports.popleft()
+        except IndexError:
+            raise RuntimeError("No free media ports") from None
+
+    def _release_port(self, call_session: CallSession):
+        """Returns a call's media port; it goes to the front so the next call reuses the warm socket"""
+        if call_session.local_port is not None:
+            self._free_ports.appendleft(call_session.local_port)
+            call_session.local_port = None
+
     def toggle_mute(self, call_id: str) -> bool:
         """Toggle mute for a call"""
         if call_id not in self.active_calls:
@@ -287,8 +384,8 @@ class NativeWebRTCService(QObject):
         try:
             response = await self.client.post(
                 f"{self.signaling_server_url}/signaling",
-                json=message,
-                timeout=5.0
+                content=orjson.dumps(message),
+                headers=JSON_HEADERS
             )
             response.raise_for_status()
         except Exception as e:
@@ -304,7 +401,7 @@ class NativeWebRTCService(QObject):
         call_type = CallType(call_data.get("call_type", "voice"))
         remote_port = call_data.get("local_port", 8091)
         
-        local_port = self.base_port + len(self.active_calls)
+        local_port = self._allocate_port()
         
         call_session = CallSession(
             call_id=call_id,
@@ -335,8 +432,13 @@ class NativeWebRTCService(QObject):
         for call_id in list(self.active_calls.keys()):
             await self.end_call(call_id)
         
-        # Stop audio handler
+        # Let queued call_end messages go out before the client closes
+        if self._pending_sig:
+            await asyncio.gather(*self._pending_sig, return_exceptions=True)
+        
+        # Stop audio handler and unbind its media ports
         self.audio_handler.stop_streaming()
+        self.audio_handler.socket_pool.close()
         
         # Close HTTP client
         await self.client.aclose()
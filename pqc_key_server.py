@@ -1,11 +1,15 @@
 # pqc_key_server.py
-import base64
+import binascii
 import logging
-import secrets
+import os
+import queue
 import uuid
 import sqlite3
 import atexit
 import sys
+import threading
+import weakref
+from collections import OrderedDict
 from typing import Optional
 
 import oqs
@@ -14,7 +18,7 @@ from kyberk2so.kem import (
     kem_encrypt_512 as kyber_kem_encrypt_512,
     kem_decrypt_512 as kyber_kem_decrypt_512,
 )
-from kyberk2so.params import Kyber512PKBytes, Kyber512SKBytes
+from kyberk2so.params import Kyber512PKBytes, Kyber512SKBytes, Kyber512CTBytes
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
@@ -26,18 +30,87 @@ log = logging.getLogger("PQC_Key_Server")
 # --- Database Setup ---
 DB_FILE = "keystore.db"
 
+# Statements are kept as constants so each one hits the connection's statement cache
+SQL_INSERT_PQC = "INSERT OR REPLACE INTO pqc_keys (userId, publicKey, privateKey) VALUES (?, ?, ?)"
+SQL_GET_PUB = "SELECT publicKey FROM pqc_keys WHERE userId = ?"
+SQL_GET_PRIV = "SELECT privateKey FROM pqc_keys WHERE userId = ?"
+SQL_INSERT_SYM = "INSERT INTO symmetric_keys (key_id, key_hex) VALUES (?, ?)"
+SQL_GET_SYM = "SELECT key_hex FROM symmetric_keys WHERE key_id = ?"
+SQL_DELETE_SYM = "DELETE FROM symmetric_keys WHERE key_id = ?"
+SQL_POP_SYM = "DELETE FROM symmetric_keys WHERE key_id = ? RETURNING key_hex"
+# DELETE ... RETURNING needs SQLite 3.35+; older libraries fall back to SELECT then DELETE
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def migrate_pqc_keys_to_blobs(con):
+    """One-time conversion of a pqc_keys table from base64 TEXT columns to BLOBs.
+
+    Runs in a single explicit transaction (sqlite3 would otherwise commit the DDL on its
+    own), so any failure leaves the original table as it was. A pqc_keys_b64 table
+    stranded by an earlier, non-atomic run of this migration is picked up and finished.
+    """
+    columns = {row[1] for row in con.execute("PRAGMA table_info(pqc_keys)")}
+    legacy = "privateKey_b64" in columns
+    stranded = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pqc_keys_b64'").fetchone()
+    if not legacy and not stranded:
+        return
+    log.info("Migrating stored PQC keys from base64 text to binary...")
+    con.commit()
+    isolation_level, con.isolation_level = con.isolation_level, None
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            source = "pqc_keys" if legacy else "pqc_keys_b64"
+            rows = []
+            # Decode everything before touching the schema; a corrupt row aborts the migration
+            for user_id, public_b64, private_b64 in con.execute(f"SELECT userId, publicKey_b64, privateKey_b64 FROM {source}"):
+                try:
+                    rows.append((user_id, binascii.a2b_base64(public_b64), binascii.a2b_base64(private_b64)))
+                except (binascii.Error, TypeError) as e:
+                    raise sqlite3.DatabaseError(f"Stored PQC keys for {user_id} are not valid base64: {e}") from e
+            if legacy:
+                con.execute("ALTER TABLE pqc_keys RENAME TO pqc_keys_b64")
+                con.execute('''
+                    CREATE TABLE pqc_keys (
+                        userId TEXT PRIMARY KEY,
+                        publicKey BLOB NOT NULL,
+                        privateKey BLOB NOT NULL
+                    )
+                ''')
+            con.executemany(SQL_INSERT_PQC, rows)
+            con.execute("DROP TABLE pqc_keys_b64")
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    finally:
+        con.isolation_level = isolation_level
+    log.info(f"Migrated {len(rows)} PQC key pairs.")
+
 def init_db():
     log.info(f"Initializing and connecting to database at {DB_FILE}...")
     try:
-        con = sqlite3.connect(DB_FILE, check_same_thread=False)
+        con = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
         cur = con.cursor()
+        # WAL turns each commit into a log append instead of a rollback-journal fsync round trip
+        cur.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+            PRAGMA mmap_size=268435456;
+        ''')
+        journal_mode = cur.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode.lower() != "wal":
+            log.warning(f"SQLite refused WAL mode, using '{journal_mode}' journal instead.")
+        # Keys are stored as raw BLOBs so decapsulation reads fewer bytes and skips a base64 decode
         cur.execute('''
             CREATE TABLE IF NOT EXISTS pqc_keys (
                 userId TEXT PRIMARY KEY,
-                publicKey_b64 TEXT NOT NULL,
-                privateKey_b64 TEXT NOT NULL
+                publicKey BLOB NOT NULL,
+                privateKey BLOB NOT NULL
             )
         ''')
+        migrate_pqc_keys_to_blobs(con)
         cur.execute('''
             CREATE TABLE IF NOT EXISTS symmetric_keys (
                 key_id TEXT PRIMARY KEY,
@@ -53,10 +126,147 @@ def init_db():
 
 db_connection = init_db()
 atexit.register(db_connection.close)
+# The connection is shared by every worker thread; sqlite3 objects are not safe to use concurrently
+db_lock = threading.Lock()
+
+# Lookups use a read-only connection per worker thread. Under WAL they read a snapshot
+# without waiting on db_lock or blocking the writer.
+_read_tls = threading.local()
+_read_connections = []
+
+def read_connection():
+    con = getattr(_read_tls, 'con', None)
+    if con is None:
+        con = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, check_same_thread=False, cached_statements=256)
+        _read_tls.con = con
+        _read_connections.append(con)
+    return con
+
+@atexit.register
+def _close_read_connections():
+    for con in _read_connections:
+        con.close()
+
+# Public keys only change through /generate-keys, which writes through to this cache
+PUBLIC_KEY_CACHE_SIZE = 4096
+_public_key_cache: "OrderedDict[str, str]" = OrderedDict()
+_public_key_cache_lock = threading.Lock()
+
+def cache_public_key(user_id: str, public_key_b64: str):
+    with _public_key_cache_lock:
+        _public_key_cache[user_id] = public_key_b64
+        _public_key_cache.move_to_end(user_id)
+        if len(_public_key_cache) > PUBLIC_KEY_CACHE_SIZE:
+            _public_key_cache.popitem(last=False)
+
+def cached_public_key(user_id: str) -> Optional[str]:
+    with _public_key_cache_lock:
+        public_key_b64 = _public_key_cache.get(user_id)
+        if public_key_b64 is not None:
+            _public_key_cache.move_to_end(user_id)
+        return public_key_b64
 
 # --- PQC Algorithm Definition ---
 # Try a more reliable algorithm if Classic-McEliece-348864 is failing
 PQC_ALGORITHM = "Kyber512"
+# Kyber512 sizes are fixed and shared by liboqs and the kyberk2so fallback.
+# kyberk2so defines them as numpy scalars; plain ints keep the per-request checks cheap.
+PUBLIC_KEY_LEN = int(Kyber512PKBytes)
+SECRET_KEY_LEN = int(Kyber512SKBytes)
+CIPHERTEXT_LEN = int(Kyber512CTBytes)
+
+# One KEM context per worker thread, reused across requests instead of built per call.
+# FastAPI runs these sync endpoints on a thread pool, so a thread never shares its context.
+_kem_tls = threading.local()
+_kem_instances = weakref.WeakSet()
+
+def _get_kem():
+    kem = getattr(_kem_tls, 'kem', None)
+    if kem is None:
+        kem = _kem_tls.kem = oqs.KEM(PQC_ALGORITHM)
+        _kem_instances.add(kem)
+    return kem
+
+@atexit.register
+def _free_kems():
+    for kem in list(_kem_instances):
+        kem.free()
+
+def _probe_oqs() -> bool:
+    """Runs one liboqs keygen/encaps/decaps round trip to decide which KEM backend serves requests."""
+    if os.environ.get("PQC_USE_KYBER_K2SO") == "1":
+        log.info("PQC_USE_KYBER_K2SO=1, using the Kyber K2SO backend.")
+        return False
+    try:
+        kem = _get_kem()
+        public_key = kem.generate_keypair()
+        private_key = kem.export_secret_key()
+        kem_ciphertext, shared_secret = kem.encap_secret(public_key)
+        if kem.decap_secret(kem_ciphertext, private_key) != shared_secret:
+            raise ValueError("decapsulated secret does not match")
+    except Exception as e:
+        log.warning(f"OQS self-test failed, using the Kyber K2SO backend instead: {e}", exc_info=True)
+        return False
+    log.info("OQS self-test passed, using liboqs.")
+    return True
+
+# Decided once at startup so requests never pay for a failed liboqs call before falling back
+USE_OQS = _probe_oqs()
+
+def kem_keypair() -> tuple[bytes, bytes]:
+    """Returns (public_key, private_key)."""
+    if USE_OQS:
+        kem = _get_kem()
+        return kem.generate_keypair(), kem.export_secret_key()
+    private_key, public_key = kyber_kem_keypair_512()
+    return public_key, private_key
+
+# Key pairs generated ahead of time so /generate-keys only has to store one
+KEYPAIR_POOL_SIZE = 32
+KEYPAIR_RETRY_DELAY = 5
+_keypair_pool: "queue.Queue[tuple[bytes, bytes]]" = queue.Queue(maxsize=KEYPAIR_POOL_SIZE)
+_keypair_pool_stop = threading.Event()
+
+def _fill_keypair_pool():
+    while not _keypair_pool_stop.is_set():
+        try:
+            keypair = kem_keypair()
+        except Exception as e:
+            log.warning(f"Background key pair generation failed: {e}")
+            _keypair_pool_stop.wait(KEYPAIR_RETRY_DELAY)
+            continue
+        _keypair_pool.put(keypair) # Blocks while the pool is full
+
+_keypair_thread = threading.Thread(target=_fill_keypair_pool, name="keypair-pool", daemon=True)
+_keypair_thread.start()
+
+@atexit.register
+def _stop_keypair_pool():
+    # Registered after _free_kems, so it runs first and the thread is done with its KEM before it is freed
+    _keypair_pool_stop.set()
+    try:
+        _keypair_pool.get_nowait() # Unblock a put() waiting on a full pool
+    except queue.Empty:
+        pass
+    _keypair_thread.join(timeout=2)
+
+def take_keypair() -> tuple[bytes, bytes]:
+    """A pooled (public_key, private_key), or a freshly generated one when the pool is empty."""
+    try:
+        return _keypair_pool.get_nowait()
+    except queue.Empty:
+        return kem_keypair()
+
+def kem_encapsulate(public_key: bytes) -> tuple[bytes, bytes]:
+    """Returns (kem_ciphertext, shared_secret)."""
+    if USE_OQS:
+        return _get_kem().encap_secret(public_key)
+    return kyber_kem_encrypt_512(public_key)
+
+def kem_decapsulate(kem_ciphertext: bytes, private_key: bytes) -> bytes:
+    if USE_OQS:
+        return _get_kem().decap_secret(kem_ciphertext, private_key)
+    return kyber_kem_decrypt_512(kem_ciphertext, private_key)
 
 app = FastAPI(
     title="Python Hybrid PQC & Symmetric Key Service (with Persistence)",
@@ -97,12 +307,18 @@ class SymmetricKeyResponse(BaseModel):
 class SymmetricKeyByIdResponse(BaseModel):
     key_hex: str
 
+# binascii directly, skipping base64.py's Python-level argument handling on every key
+def b64encode(data: bytes) -> str:
+    return binascii.b2a_base64(data, newline=False).decode('ascii')
+
+def b64decode(data: str) -> bytes:
+    return binascii.a2b_base64(data)
+
 def xor_bytes(a: bytes, b: bytes) -> bytes:
-    # Pad the shorter input to the length of the longer one
+    # XOR as two integers in one C-level operation. Little-endian keeps the
+    # shorter input zero-padded on the right, as with ljust.
     max_len = max(len(a), len(b))
-    a = a.ljust(max_len, b'\0')
-    b = b.ljust(max_len, b'\0')
-    return bytes(x ^ y for x, y in zip(a, b))
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(max_len, 'little')
 
 # --- API Endpoints (Rewritten for DB) ---
 
@@ -110,41 +326,29 @@ def xor_bytes(a: bytes, b: bytes) -> bytes:
 def generate_keys(request: GenerateKeysRequest):
     log.info(f"Generating new key pair for userId: {request.userId}")
     try:
-        kem = oqs.KEM(PQC_ALGORITHM)
-        public_key = kem.generate_keypair()
-        private_key = kem.export_secret_key()
+        public_key, private_key = take_keypair()
         # Defensive: check for None or empty keys
         if not public_key or not private_key:
-            log.error("Key generation returned empty keys.")
-            raise Exception("Key generation failed: empty keys.")
+            raise ValueError("empty keys")
     except Exception as e:
-        log.critical(
-            f"FATAL: OQS key generation failed. Attempting Kyber K2SO fallback. Error: {e}",
-            exc_info=True,
+        log.critical(f"FATAL: Key generation failed ({'OQS' if USE_OQS else 'Kyber K2SO'}): {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Server crypto library failed to generate keys. Error: {e}",
         )
-        try:
-            private_key, public_key = kyber_kem_keypair_512()
-        except Exception as k2e:
-            log.critical("Kyber K2SO fallback key generation failed.", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail=f"Server crypto library failed to generate keys (OQS and Kyber K2SO). Error: {k2e}",
-            )
 
     try:
-        public_key_b64 = base64.b64encode(public_key).decode('utf-8')
-        private_key_b64 = base64.b64encode(private_key).decode('utf-8')
+        public_key_b64 = b64encode(public_key)
+        private_key_b64 = b64encode(private_key)
     except Exception as e:
         log.error(f"Base64 encoding failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Base64 encoding failed for generated keys.")
 
     try:
-        cur = db_connection.cursor()
-        cur.execute(
-            "INSERT OR REPLACE INTO pqc_keys (userId, publicKey_b64, privateKey_b64) VALUES (?, ?, ?)",
-            (request.userId, public_key_b64, private_key_b64)
-        )
-        db_connection.commit()
+        with db_lock:
+            db_connection.execute(SQL_INSERT_PQC, (request.userId, public_key, private_key))
+            db_connection.commit()
+        cache_public_key(request.userId, public_key_b64)
         log.info(f"Stored PQC keys for {request.userId} in database.")
         return GenerateKeysResponse(publicKey_b64=public_key_b64, privateKey_b64=private_key_b64)
     except sqlite3.Error as e:
@@ -153,13 +357,15 @@ def generate_keys(request: GenerateKeysRequest):
 
 @app.get("/get-public-key/{userId}", response_model=PublicKeyResponse)
 def get_public_key(userId: str):
+    if (public_key_b64 := cached_public_key(userId)) is not None:
+        return PublicKeyResponse(publicKey_b64=public_key_b64)
     try:
-        cur = db_connection.cursor()
-        cur.execute("SELECT publicKey_b64 FROM pqc_keys WHERE userId = ?", (userId,))
-        result = cur.fetchone()
+        result = read_connection().execute(SQL_GET_PUB, (userId,)).fetchone()
         if not result:
             raise HTTPException(status_code=404, detail=f"Public key for user '{userId}' not found.")
-        return PublicKeyResponse(publicKey_b64=result[0])
+        public_key_b64 = b64encode(result[0])
+        cache_public_key(userId, public_key_b64)
+        return PublicKeyResponse(publicKey_b64=public_key_b64)
     except Exception as e:
         log.error(f"Error fetching public key for {userId}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch public key.")
@@ -168,35 +374,28 @@ def get_public_key(userId: str):
 def decapsulate(request: DecapsulateRequest):
     log.info(f"Starting decapsulation for user {request.userId}")
     try:
-        cur = db_connection.cursor()
-        cur.execute("SELECT privateKey_b64 FROM pqc_keys WHERE userId = ?", (request.userId,))
-        result = cur.fetchone()
+        result = read_connection().execute(SQL_GET_PRIV, (request.userId,)).fetchone()
         if not result:
             raise HTTPException(status_code=404, detail=f"Private key for user '{request.userId}' not found.")
 
-        private_key = base64.b64decode(result[0])
-        kem_ciphertext = base64.b64decode(request.kem_ciphertext_b64)
-        encrypted_symmetric_key = base64.b64decode(request.encrypted_symmetric_key_b64)
+        private_key = result[0]
+        kem_ciphertext = b64decode(request.kem_ciphertext_b64)
+        # Reject malformed input before it reaches the KEM (some liboqs builds abort on it)
+        if len(kem_ciphertext) != CIPHERTEXT_LEN:
+            raise HTTPException(status_code=400, detail=f"KEM ciphertext must be {CIPHERTEXT_LEN} bytes.")
+        if len(private_key) != SECRET_KEY_LEN:
+            log.error(f"Stored private key for {request.userId} is {len(private_key)} bytes, expected {SECRET_KEY_LEN}.")
+            raise HTTPException(status_code=500, detail="Stored private key is corrupt.")
+        encrypted_symmetric_key = b64decode(request.encrypted_symmetric_key_b64)
 
-        try:
-            kem = oqs.KEM(PQC_ALGORITHM)
-            shared_secret = kem.decap_secret(kem_ciphertext, private_key)
-        except Exception as e:
-            log.warning(
-                f"OQS decapsulation failed, trying Kyber K2SO fallback for user {request.userId}: {e}",
-                exc_info=True,
-            )
-            # Fallback to Kyber K2SO
-            try:
-                shared_secret = kyber_kem_decrypt_512(kem_ciphertext, private_key)
-            except Exception as k2e:
-                log.error(f"Kyber K2SO decapsulation also failed: {k2e}", exc_info=True)
-                raise HTTPException(status_code=500, detail="Decapsulation failed.")
+        shared_secret = kem_decapsulate(kem_ciphertext, private_key)
         decrypted_symmetric_key = xor_bytes(encrypted_symmetric_key, shared_secret)
 
         return DecapsulateResponse(
-            plaintextKey_b64=base64.b64encode(decrypted_symmetric_key).decode('utf-8')
+            plaintextKey_b64=b64encode(decrypted_symmetric_key)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(f"Decapsulation failed for user {request.userId}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Decapsulation failed.")
@@ -204,26 +403,19 @@ def decapsulate(request: DecapsulateRequest):
 @app.post("/encapsulate", response_model=EncapsulateResponse)
 def encapsulate(request: EncapsulateRequest):
     try:
-        public_key = base64.b64decode(request.publicKey_b64)
-        plaintext_key = base64.b64decode(request.plaintextKey_b64)
-        try:
-            kem = oqs.KEM(PQC_ALGORITHM)
-            kem_ciphertext, shared_secret = kem.encap_secret(public_key)
-        except Exception as e:
-            log.warning(
-                f"OQS encapsulation failed, trying Kyber K2SO fallback: {e}",
-                exc_info=True,
-            )
-            try:
-                kem_ciphertext, shared_secret = kyber_kem_encrypt_512(public_key)
-            except Exception as k2e:
-                log.error(f"Kyber K2SO encapsulation also failed: {k2e}", exc_info=True)
-                raise HTTPException(status_code=500, detail="Encapsulation failed.")
+        public_key = b64decode(request.publicKey_b64)
+        # Reject malformed keys before they reach the KEM (some liboqs builds abort on them)
+        if len(public_key) != PUBLIC_KEY_LEN:
+            raise HTTPException(status_code=400, detail=f"Public key must be {PUBLIC_KEY_LEN} bytes.")
+        plaintext_key = b64decode(request.plaintextKey_b64)
+        kem_ciphertext, shared_secret = kem_encapsulate(public_key)
         encrypted_symmetric_key = xor_bytes(plaintext_key, shared_secret)
         return EncapsulateResponse(
-            kem_ciphertext_b64=base64.b64encode(kem_ciphertext).decode('utf-8'),
-            encrypted_symmetric_key_b64=base64.b64encode(encrypted_symmetric_key).decode('utf-8')
+            kem_ciphertext_b64=b64encode(kem_ciphertext),
+            encrypted_symmetric_key_b64=b64encode(encrypted_symmetric_key)
         )
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(f"Encapsulation failed: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Encapsulation failed.")
@@ -231,11 +423,11 @@ def encapsulate(request: EncapsulateRequest):
 @app.get("/get-symmetric-key", response_model=SymmetricKeyResponse)
 def get_symmetric_key(key_length_bytes: int):
     key_id = str(uuid.uuid4())
-    key_hex = secrets.token_hex(key_length_bytes)
+    key_hex = binascii.hexlify(os.urandom(key_length_bytes)).decode('ascii')
     try:
-        cur = db_connection.cursor()
-        cur.execute("INSERT INTO symmetric_keys (key_id, key_hex) VALUES (?, ?)", (key_id, key_hex))
-        db_connection.commit()
+        with db_lock:
+            db_connection.execute(SQL_INSERT_SYM, (key_id, key_hex))
+            db_connection.commit()
         return SymmetricKeyResponse(key_id=key_id, key_hex=key_hex)
     except sqlite3.Error as e:
         log.error(f"DB Error on symmetric key generation: {e}", exc_info=True)
@@ -244,14 +436,26 @@ def get_symmetric_key(key_length_bytes: int):
 @app.get("/get-symmetric-key-by-id/{key_id}", response_model=SymmetricKeyByIdResponse)
 def get_symmetric_key_by_id(key_id: str):
     try:
-        cur = db_connection.cursor()
-        cur.execute("SELECT key_hex FROM symmetric_keys WHERE key_id = ?", (key_id,))
-        result = cur.fetchone()
+        with db_lock:
+            if SQLITE_HAS_RETURNING:
+                # One statement reads and deletes, so the key can only be handed out once
+                rows = db_connection.execute(SQL_POP_SYM, (key_id,)).fetchall()
+                db_connection.commit()
+                result = rows[0] if rows else None
+            else:
+                # Read and delete in one write transaction so the key can only be handed out once
+                db_connection.execute("BEGIN IMMEDIATE")
+                try:
+                    result = db_connection.execute(SQL_GET_SYM, (key_id,)).fetchone()
+                    if result:
+                        db_connection.execute(SQL_DELETE_SYM, (key_id,))
+                    db_connection.commit()
+                except BaseException:
+                    db_connection.rollback()
+                    raise
         if not result:
             raise HTTPException(status_code=404, detail="Symmetric key not found.")
         key_hex = result[0]
-        cur.execute("DELETE FROM symmetric_keys WHERE key_id = ?", (key_id,))
-        db_connection.commit()
         return SymmetricKeyByIdResponse(key_hex=key_hex)
     except HTTPException:
         # Propagate explicit HTTP errors (e.g., 404) without converting to 500
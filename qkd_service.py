@@ -4,15 +4,17 @@ import logging
 import os
 import json
 import base64
+import hashlib
 import httpx
+import orjson
 from typing import Optional, Dict, Any
 from etsi_qkd_014_client import QKD014Client
 from firebase_directory import FirebaseDirectory
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
 
 log = logging.getLogger(__name__)
 
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
 class QKDServiceError(Exception):
     """Custom exception for QKD service errors"""
     pass
@@ -41,7 +43,13 @@ class QKDService:
         
         # Initialize QKD client
         self.qkd_client = None
-        self.directory = FirebaseDirectory("https://qu--mail-default-rtdb.firebaseio.com")
+        # One pooled client for every Firebase call instead of a fresh TLS handshake per request
+        self._http = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=8),
+            http2=True,
+        )
+        self.directory = FirebaseDirectory("https://qu--mail-default-rtdb.firebaseio.com", client=self._http)
         
         # For simulation purposes, we'll store quantum keys locally
         self._quantum_keys_cache: Dict[str, Dict[str, Any]] = {}
@@ -165,10 +173,9 @@ class QKDService:
                 # Note: We deliberately do NOT store the actual key_hex
             }
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.put(url, json=metadata_to_store)
-                response.raise_for_status()
-                log.info(f"Stored QKD key metadata for {key_id} in Firebase")
+            response = await self._http.put(url, content=orjson.dumps(metadata_to_store), headers=JSON_HEADERS)
+            response.raise_for_status()
+            log.info(f"Stored QKD key metadata for {key_id} in Firebase")
                 
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 401:
@@ -184,15 +191,14 @@ class QKDService:
             safe_key_id = key_id.replace('.', '(dot)')
             url = f"{self.directory.database_url}/qkd_keys/{safe_key_id}.json"
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url)
-                response.raise_for_status()
-                data = response.json()
-                
-                if isinstance(data, dict):
-                    # Return metadata, but note that the actual key is not stored
-                    log.info(f"Retrieved QKD key metadata for {key_id} from Firebase")
-                    return data
+            response = await self._http.get(url)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            
+            if isinstance(data, dict):
+                # Return metadata, but note that the actual key is not stored
+                log.info(f"Retrieved QKD key metadata for {key_id} from Firebase")
+                return data
                     
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 401:
@@ -236,6 +242,7 @@ class QKDService:
                 self.qkd_client = None
             
             await self.directory.close()
+            await self._http.aclose()
             log.info("QKD service closed successfully")
             
         except Exception as e:
@@ -272,20 +279,16 @@ class MockQKDClient:
         """
         # Using SHA256 on the key_id to deterministically derive the key.
         # This is a simulation, as a real QKD system would provide the key directly.
-        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        digest.update(key_id.encode('utf-8'))
-        seed = digest.finalize()
+        # The chain must stay byte-for-byte the same: recipients re-derive keys for existing messages.
+        block = hashlib.sha256(key_id.encode('utf-8')).digest()
         
-        # Expand the seed to the required key_length if needed
-        key = b''
-        while len(key) < key_length:
-            hasher = hashes.Hash(hashes.SHA256(), backend=default_backend())
-            hasher.update(seed)
-            next_block = hasher.finalize()
-            key += next_block
-            seed = next_block # Use output as next seed for continuous expansion
+        # Expand the seed to the required key_length, each block hashing the previous one
+        blocks = []
+        for _ in range(-(-key_length // 32)):
+            block = hashlib.sha256(block).digest()
+            blocks.append(block)
             
-        return key[:key_length]
+        return b''.join(blocks)[:key_length]
 
     async def close(self):
         """Close the mock QKD client"""
@@ -37,6 +37,8 @@ def main():
         except Exception as e:
             log.error(f"Failed to load stylesheet: {e}")
         
+        # qasync runs asyncio on top of the Qt event loop, so an alternative
+        # loop policy such as uvloop cannot be installed for the client.
         loop = qasync.QEventLoop(app)
         asyncio.set_event_loop(loop)
 
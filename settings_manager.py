@@ -1,7 +1,9 @@
 # settings_manager.py
+import asyncio
 import configparser
 import keyring
 import os
+import threading
 from pathlib import Path
 import httpx
 import logging
@@ -19,68 +21,91 @@ class SettingsManager:
         self.config = configparser.ConfigParser()
         # Preload file if exists to allow getters before save
         self.config.read(self.config_path)
+        # Parsed settings from the last load_settings(), valid while the file's mtime is unchanged
+        self._cache = None
+        self._cache_mtime = 0
+        self._client = None
+        # Held while config.ini is rewritten, which can happen from aload_settings' worker thread
+        self._file_lock = threading.Lock()
+
+    @staticmethod
+    def _create_http_client() -> httpx.AsyncClient:
+        """Kept warm across saves; key generation can be slow, so only connecting is held to a tight limit"""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(20.0, connect=5.0, pool=None),
+            limits=httpx.Limits(max_keepalive_connections=4, max_connections=10),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_http_client()
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
 
     async def save_settings(self, email, password, imap_host, smtp_host, smtp_port, km_url, qkd_server_url=None, agora_app_id=None, agora_app_cert=None, agora_token_endpoint=None):
-        self.config['DEFAULT'] = {
+        # load_settings may swap self.config from a worker thread; keep working on this parser
+        config = self.config
+        config['DEFAULT'] = {
             'email_address': email,
             'imap_host': imap_host,
             'smtp_host': smtp_host,
             'smtp_port': smtp_port,
             'km_url': km_url,
             'qkd_server_url': qkd_server_url or '',
-            'agora_app_id': (agora_app_id or self.config.get('DEFAULT', 'agora_app_id', fallback='')),
+            'agora_app_id': (agora_app_id or config.get('DEFAULT', 'agora_app_id', fallback='')),
             # Do NOT store cert in plain text file; use keyring
-            'agora_token_endpoint': (agora_token_endpoint or self.config.get('DEFAULT', 'agora_token_endpoint', fallback='')),
+            'agora_token_endpoint': (agora_token_endpoint or config.get('DEFAULT', 'agora_token_endpoint', fallback='')),
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                log.info(f"Requesting new PQC key pair from {km_url}/generate-keys for {email}")
-                response = await client.post(f"{km_url}/generate-keys", json={"userId": email}, timeout=20.0)
-                response.raise_for_status()
-                key_data = response.json()
-                
-                public_key_b64 = key_data['publicKey_b64']
-                private_key_b64 = key_data['privateKey_b64']
-                
-                self.config['DEFAULT']['pqc_public_key_b64'] = public_key_b64
-                try:
-                    keyring.set_password("QuMail_PQC_Private", email, private_key_b64)
-                    log.info(f"Successfully stored new PQC private key for {email} in secure keyring.")
-                except Exception as ke:
-                    # Fallback: write to app data file if Windows Credential Manager fails
-                    fallback_priv_path = Path.home() / ".qumail" / f"{email}.pqc_priv.b64"
-                    try:
-                        with open(fallback_priv_path, 'w') as f:
-                            f.write(private_key_b64)
-                        log.warning(
-                            f"Keyring storage failed; wrote PQC private key to fallback file: {fallback_priv_path}")
-                    except Exception as fe:
-                        log.error(f"Failed to persist PQC private key via fallback file: {fe}", exc_info=True)
-                        raise KeyGenerationError(
-                            "Failed to securely store PQC private key. Keyring and file fallback both failed.")
-
-            # Publish public key to Firebase directory (best-effort)
+            log.info(f"Requesting new PQC key pair from {km_url}/generate-keys for {email}")
+            response = await self.client.post(f"{km_url}/generate-keys", json={"userId": email})
+            response.raise_for_status()
+            key_data = response.json()
+            
+            public_key_b64 = key_data['publicKey_b64']
+            private_key_b64 = key_data['privateKey_b64']
+            
+            config['DEFAULT']['pqc_public_key_b64'] = public_key_b64
             try:
-                from firebase_directory import FirebaseDirectory
-                directory = FirebaseDirectory("https://qu--mail-default-rtdb.firebaseio.com")
-                await directory.publish_public_key(email, public_key_b64)
-                await directory.close()
-            except Exception:
-                log.warning("Failed to publish public key to Firebase; continuing with local save.")
-
-            # --- CRITICAL FIX: Only write the config file and password if all API calls succeed ---
-            with open(self.config_path, 'w') as configfile:
-                self.config.write(configfile)
-
-            if password:
-                keyring.set_password("QuMail", email, password)
-            # Store Agora certificate in keyring if provided
-            if agora_app_cert:
+                await asyncio.to_thread(keyring.set_password, "QuMail_PQC_Private", email, private_key_b64)
+                log.info(f"Successfully stored new PQC private key for {email} in secure keyring.")
+            except Exception as ke:
+                # Fallback: write to app data file if Windows Credential Manager fails
+                fallback_priv_path = Path.home() / ".qumail" / f"{email}.pqc_priv.b64"
                 try:
-                    keyring.set_password("QuMail_Agora_Cert", "agora", agora_app_cert)
-                except Exception as ke:
-                    log.warning(f"Failed to store Agora certificate in keyring: {ke}")
+                    with open(fallback_priv_path, 'w') as f:
+                        f.write(private_key_b64)
+                    log.warning(
+                        f"Keyring storage failed; wrote PQC private key to fallback file: {fallback_priv_path}")
+                except Exception as fe:
+                    log.error(f"Failed to persist PQC private key via fallback file: {fe}", exc_info=True)
+                    raise KeyGenerationError(
+                        "Failed to securely store PQC private key. Keyring and file fallback both failed.")
+
+            # The private key is safe now, so the Firebase publish can overlap the local writes
+            publish_task = asyncio.create_task(self._publish_public_key(email, public_key_b64))
+            try:
+                # --- CRITICAL FIX: Only write the config file and password if all API calls succeed ---
+                with self._file_lock, open(self.config_path, 'w') as configfile:
+                    config.write(configfile)
+                self.config = config
+
+                if password:
+                    await asyncio.to_thread(keyring.set_password, "QuMail", email, password)
+                # Store Agora certificate in keyring if provided
+                if agora_app_cert:
+                    try:
+                        await asyncio.to_thread(keyring.set_password, "QuMail_Agora_Cert", "agora", agora_app_cert)
+                    except Exception as ke:
+                        log.warning(f"Failed to store Agora certificate in keyring: {ke}")
+            finally:
+                await asyncio.gather(publish_task, return_exceptions=True)
+            self._cache_mtime = 0
 
         except httpx.HTTPStatusError as e:
             error_message = f"Client error '{e.response.status_code} {e.response.reason_phrase}' for url '{e.request.url}'"
@@ -90,24 +115,50 @@ class SettingsManager:
             log.error(f"Network error during key generation: {e}", exc_info=True)
             raise KeyGenerationError(f"Could not connect to the Key Management service.\n\nPlease ensure the service is running and the URL is correct.\n\nError: {e}")
 
+    async def _publish_public_key(self, email, public_key_b64):
+        """Publishes the public key to the Firebase directory (best-effort)"""
+        try:
+            from firebase_directory import FirebaseDirectory
+            directory = FirebaseDirectory("https://qu--mail-default-rtdb.firebaseio.com", client=self.client)
+            await directory.publish_public_key(email, public_key_b64)
+            await directory.close()
+        except Exception:
+            log.warning("Failed to publish public key to Firebase; continuing with local save.")
+
+    async def aload_settings(self):
+        """load_settings() for coroutines; a cache miss hits the OS keyring, which can block for a while"""
+        return await asyncio.to_thread(self.load_settings)
+
     def load_settings(self):
-        if not self.config.read(self.config_path):
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if self._cache is not None and mtime == self._cache_mtime:
+            return dict(self._cache)
+
+        # Parse into a local parser: this may run in a worker thread while save_settings edits self.config
+        config = configparser.ConfigParser()
+        if not config.read(self.config_path):
             return {}
 
-        settings = dict(self.config['DEFAULT'])
+        settings = dict(config['DEFAULT'])
         
         # --- AUTO-MIGRATION FIX for stale config URL ---
         km_url = settings.get("km_url")
         if km_url == "http://127.0.0.1:8000":
             log.warning("Detected outdated key manager URL. Auto-updating to port 8001.")
             settings["km_url"] = "http://127.0.0.1:8001"
-            self.config['DEFAULT']['km_url'] = "http://127.0.0.1:8001"
-            with open(self.config_path, 'w') as configfile:
-                self.config.write(configfile)
+            config['DEFAULT']['km_url'] = "http://127.0.0.1:8001"
+            with self._file_lock, open(self.config_path, 'w') as configfile:
+                config.write(configfile)
+            mtime = os.stat(self.config_path).st_mtime_ns
+        self.config = config
         
         email_address = settings.get("email_address")
         if not email_address:
-            return settings
+            self._cache, self._cache_mtime = settings, mtime
+            return dict(settings)
 
         settings['password'] = keyring.get_password("QuMail", email_address)
         pqc_priv = keyring.get_password("QuMail_PQC_Private", email_address)
@@ -124,12 +175,13 @@ class SettingsManager:
         settings['pqc_private_key_b64'] = pqc_priv
 
         # Load Agora settings
-        settings['agora_app_id'] = self.config.get('DEFAULT', 'agora_app_id', fallback='')
-        settings['agora_token_endpoint'] = self.config.get('DEFAULT', 'agora_token_endpoint', fallback='')
+        settings['agora_app_id'] = config.get('DEFAULT', 'agora_app_id', fallback='')
+        settings['agora_token_endpoint'] = config.get('DEFAULT', 'agora_token_endpoint', fallback='')
         try:
             settings['agora_app_cert'] = keyring.get_password("QuMail_Agora_Cert", "agora")
         except Exception:
             settings['agora_app_cert'] = None
         
-        return settings
+        self._cache, self._cache_mtime = settings, mtime
+        return dict(settings)
 
@@ -0,0 +1,163 @@
+# tests/test_email_services.py
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_services import ImapHandler, _decode_transfer, _fetch_items, _walk_bodystructure
+
+# UID FETCH responses in the shape imaplib returns them: literals come back as
+# (prefix, literal) tuples, everything else as plain bytes lines.
+
+NESTED_MULTIPART = [
+    b'12 (UID 42 BODYSTRUCTURE (((('
+    b'"TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 12 1 NIL NIL NIL NIL)('
+    b'"TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 40 1 NIL NIL NIL NIL) '
+    b'"ALTERNATIVE" ("BOUNDARY" "b2") NIL NIL)('
+    b'"IMAGE" "PNG" ("NAME" "logo.png") "<logo@example.com>" NIL "BASE64" 100 NIL '
+    b'("INLINE" ("FILENAME" "logo.png")) NIL NIL) '
+    b'"RELATED" ("BOUNDARY" "b1") NIL NIL)('
+    b'"APPLICATION" "PDF" ("NAME" "report.pdf") NIL NIL "BASE64" 2000 NIL '
+    b'("ATTACHMENT" ("FILENAME" "report.pdf")) NIL NIL) '
+    b'"MIXED" ("BOUNDARY" "b0") NIL NIL))'
+]
+
+LITERAL_FILENAME = [
+    (b'3 (UID 7 BODYSTRUCTURE ("APPLICATION" "OCTET-STREAM" ("NAME" {9}', b'a "b".txt'),
+    b') NIL NIL "BASE64" 10 NIL ("ATTACHMENT" NIL) NIL NIL))',
+]
+
+RFC2231_NAME = [
+    b'5 (UID 9 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "US-ASCII") NIL NIL "7BIT" 3 1 NIL NIL NIL NIL)('
+    b'"APPLICATION" "PDF" ("NAME*" "utf-8\'\'%E2%82%AC%20rates.pdf") NIL NIL "BASE64" 10 NIL '
+    b'("ATTACHMENT" ("FILENAME*" "utf-8\'\'%E2%82%AC%20rates.pdf")) NIL NIL) '
+    b'"MIXED" ("BOUNDARY" "x") NIL NIL))'
+]
+
+FORWARDED_MESSAGE = [
+    b'8 (UID 11 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 5 1 NIL NIL NIL NIL)('
+    b'"MESSAGE" "RFC822" NIL NIL NIL "7BIT" 500 '
+    b'("Mon, 1 Jan 2024 00:00:00 +0000" "Hi" (("Ann" NIL "ann" "example.org")) '
+    b'(("Ann" NIL "ann" "example.org")) (("Ann" NIL "ann" "example.org")) '
+    b'(("Bob" NIL "bob" "example.net")) NIL NIL NIL "<id@example.org>") '
+    b'("TEXT" "PLAIN" ("CHARSET" "US-ASCII") NIL NIL "7BIT" 20 2 NIL NIL NIL NIL) 12 NIL '
+    b'("ATTACHMENT" ("FILENAME" "fwd.eml")) NIL NIL) '
+    b'"MIXED" ("BOUNDARY" "y") NIL NIL))'
+]
+
+def _leaves(response):
+    return list(_walk_bodystructure(_fetch_items(response)['BODYSTRUCTURE']))
+
+class BodyStructureTests(unittest.TestCase):
+    def test_nested_multipart_sections(self):
+        leaves = _leaves(NESTED_MULTIPART)
+        self.assertEqual([p['section'] for p in leaves], ['1.1.1', '1.1.2', '1.2', '2'])
+        self.assertEqual([p['content_type'] for p in leaves],
+                         ['text/plain', 'text/html', 'image/png', 'application/pdf'])
+        plain, html, image, pdf = leaves
+        self.assertEqual(plain['charset'], 'UTF-8')
+        self.assertEqual(html['encoding'], 'quoted-printable')
+        self.assertEqual((image['disposition'], image['content_id']), ('inline', '<logo@example.com>'))
+        self.assertEqual((pdf['disposition'], pdf['filename'], pdf['size']), ('attachment', 'report.pdf', 2000))
+
+    def test_literal_in_bodystructure(self):
+        (part,) = _leaves(LITERAL_FILENAME)
+        self.assertEqual(part['section'], '1')
+        self.assertEqual(part['filename'], 'a "b".txt')
+        self.assertEqual(part['disposition'], 'attachment')
+
+    def test_rfc2231_filename(self):
+        _text, attachment = _leaves(RFC2231_NAME)
+        self.assertEqual(attachment['filename'], '€ rates.pdf')
+
+    def test_message_rfc822_is_a_single_leaf(self):
+        _text, forwarded = _leaves(FORWARDED_MESSAGE)
+        self.assertEqual(forwarded['section'], '2')
+        self.assertEqual(forwarded['content_type'], 'message/rfc822')
+        self.assertEqual((forwarded['disposition'], forwarded['filename']), ('attachment', 'fwd.eml'))
+
+class FetchItemsTests(unittest.TestCase):
+    def test_body_sections_from_literals(self):
+        response = [
+            (b'4 (UID 7 BODY[HEADER] {19}', b'Subject: Hi\r\n\r\n\r\n\r\n'),
+            (b' BODY[1] {5}', b'hello'),
+            b')',
+        ]
+        items = _fetch_items(response)
+        self.assertEqual(items['BODY[HEADER]'], b'Subject: Hi\r\n\r\n\r\n\r\n')
+        self.assertEqual(items['BODY[1]'], b'hello')
+
+    def test_unterminated_list_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _fetch_items([b'1 (UID 1 BODYSTRUCTURE ("TEXT" "PLAIN"'])
+
+class DecodeTransferTests(unittest.TestCase):
+    def test_base64_with_line_breaks(self):
+        self.assertEqual(_decode_transfer(b'aGVsbG8g\r\nd29ybGQ=\r\n', 'base64'), b'hello world')
+
+    def test_base64_with_bad_padding(self):
+        self.assertEqual(_decode_transfer(b'QUJ', 'base64'), b'AB')
+        self.assertEqual(_decode_transfer(b'QUJDR', 'base64'), b'ABC')
+
+    def test_quoted_printable(self):
+        self.assertEqual(_decode_transfer(b'caf=C3=A9=\r\n!', 'quoted-printable'), b'caf\xc3\xa9!')
+
+    def test_identity_encodings(self):
+        self.assertEqual(_decode_transfer(b'plain', '7bit'), b'plain')
+
+class _CapturedImap:
+    """Replays canned UID FETCH responses keyed by the fetch items requested."""
+    def __init__(self, responses):
+        self.responses = responses
+
+    def uid(self, command, uid, items):
+        return 'OK', self.responses[items]
+
+    def select(self, mailbox, readonly=False):
+        return 'OK', [b'1']
+
+class FetchFullEmailTests(unittest.TestCase):
+    def _handler(self, responses):
+        handler = ImapHandler('imap.example.com', 'user', 'secret')
+        handler.imap, handler.is_connected, handler.selected_folder = _CapturedImap(responses), True, 'INBOX'
+        return handler
+
+    def test_bad_inline_image_does_not_fail_the_message(self):
+        structure = [
+            b'1 (UID 5 BODYSTRUCTURE (("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "7BIT" 30 1 NIL NIL NIL NIL)('
+            b'"IMAGE" "PNG" NIL "<img1>" NIL "BASE64" 3 NIL ("INLINE" NIL) NIL NIL) '
+            b'"RELATED" ("BOUNDARY" "r") NIL NIL))'
+        ]
+        html = b'<p>Hi <img src="cid:img1"></p>'
+        body = [
+            (b'1 (UID 5 BODY[HEADER] {15}', b'Subject: Hi\r\n\r\n'),
+            (b' BODY[1] {%d}' % len(html), html),
+            (b' BODY[2] {1}', b'Q'),
+            b')',
+        ]
+        handler = self._handler({
+            '(BODYSTRUCTURE)': structure,
+            '(BODY.PEEK[HEADER] BODY.PEEK[1] BODY.PEEK[2])': body,
+        })
+        result = asyncio.run(handler.fetch_full_email('5'))
+        self.assertIn('Hi', result['html_body'])
+        self.assertEqual(result['raw_message']['Subject'], 'Hi')
+
+    def test_attachments_are_deferred(self):
+        body = [(b'12 (UID 42 BODY[HEADER] {15}', b'Subject: Re\r\n\r\n'), (b' BODY[1.1.2] {4}', b'<b>x'), b')']
+        handler = self._handler({
+            '(BODYSTRUCTURE)': NESTED_MULTIPART,
+            # Only the HTML body is downloaded; named parts (even the inline logo) are attachments
+            '(BODY.PEEK[HEADER] BODY.PEEK[1.1.2])': body,
+        })
+        result = asyncio.run(handler.fetch_full_email('42'))
+        self.assertIn('<b>x</b>', result['html_body'])
+        logo, report = result['attachments']
+        self.assertEqual((logo['filename'], report['filename']), ('logo.png', 'report.pdf'))
+        self.assertIsNone(report['content'])
+        self.assertEqual(report['location'], ('INBOX', '42', '2', 'base64'))
+
+if __name__ == '__main__':
+    unittest.main()
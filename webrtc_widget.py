@@ -140,6 +140,24 @@ class WebRTCWidget(QWebEngineView):
         except Exception as e:
             log.error(f"Error handling ICE candidate: {e}")
     
+    def handle_ice_candidates(self, call_id: str, candidates: list):
+        """Handle a batch of ICE candidates from Firebase in one page call"""
+        try:
+            import json
+            js_code = f"""
+            if (window.webrtcManager) {{
+                for (const candidate of {json.dumps(candidates)}) {{
+                    window.webrtcManager.handleIceCandidate({{
+                        callId: '{call_id}',
+                        candidate: candidate
+                    }});
+                }}
+            }}
+            """
+            self.web_view.page().runJavaScript(js_code)
+        except Exception as e:
+            log.error(f"Error handling ICE candidates: {e}")
+    
     def setup_web_view(self):
         """Setup the web view with WebRTC capabilities"""
         # Create a custom page